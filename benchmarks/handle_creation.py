@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Measure what short lived :class:`shm_dict.SHMDict` handles cost.
+
+Run from the repository root with::
+
+    python benchmarks/handle_creation.py --number 10000
+"""
+
+# Standard library imports
+import argparse
+import timeit
+
+# Related third party imports (If you used pip/apt/yum to install)
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from shm_dict import SHMDict
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle-shm_dict@natrinicle.com"
+__status__ = "Production"
+
+
+def construct_close(name):
+    """Create a handle and close it without using it."""
+    SHMDict(name).close()
+
+
+def construct_get_close(name):
+    """Create a handle, read one key from an existing segment and close it."""
+    handle = SHMDict(name)
+    handle["key"]
+    handle.close()
+
+
+def safe_names(handle):
+    """Read both IPC names the way every lock and comparison does."""
+    return handle.safe_sem_name, handle.safe_shm_name
+
+
+def report(label, seconds, number):
+    """Print the time per call in microseconds."""
+    print("{:<28} {:>10.2f} us".format(label, seconds / number * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--name", default="BenchHandleCreation")
+    parser.add_argument("--number", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Keep the segment alive so handles attach rather than create it
+    with SHMDict(args.name) as keep_alive:
+        keep_alive["key"] = "value"
+
+        for label, func, arg in (
+            ("construct + close", construct_close, "{}Unused".format(args.name)),
+            ("construct + get + close", construct_get_close, args.name),
+            ("safe names", safe_names, keep_alive),
+        ):
+            best = min(
+                timeit.repeat(lambda: func(arg), number=args.number, repeat=args.repeat)
+            )
+            report(label, best, args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare stable key hashing with hashing the pickled key.
+
+Run from the repository root with::
+
+    python benchmarks/key_hashing.py --number 100000
+"""
+
+# Standard library imports
+import argparse
+import hashlib
+import pickle  # nosec
+import struct
+import timeit
+
+# Related third party imports (If you used pip/apt/yum to install)
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from shm_dict.hashing import HASHERS, KeyHasher
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle-shm_dict@natrinicle.com"
+__status__ = "Production"
+
+KEYS = {
+    "str": "user:1234567890",
+    "bytes": b"user:1234567890",
+    "int": 1234567890,
+    "tuple": ("user", 1234567890),
+}
+
+_HASH = struct.Struct("<Q")
+
+
+def pickled_hash(key):
+    """64 bit BLAKE2b of the pickled key, how any key can be hashed stably."""
+    digest = hashlib.blake2b(pickle.dumps(key, 2), digest_size=_HASH.size).digest()
+    return _HASH.unpack(digest)[0]
+
+
+def report(label, seconds, number):
+    """Print the time per call in nanoseconds."""
+    print("{:<32} {:>10.0f} ns".format(label, seconds / number * 1e9))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for kind, key in sorted(KEYS.items()):
+        candidates = [("pickled key", pickled_hash), ("builtin hash()", hash)]
+        for hasher in sorted(HASHERS):
+            candidates.append((hasher, KeyHasher(1234, hasher)))
+        for label, func in candidates:
+            best = min(
+                timeit.repeat(lambda: func(key), number=args.number, repeat=args.repeat)
+            )
+            report("{} {}".format(kind, label), best, args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,7 +33,12 @@ setup(
     project_urls={"Source": "https://github.com/Natrinicle/shm_dict"},
     packages=find_packages(),
     install_requires=open("requirements.txt").read().split("\n"),
-    extras_require={"dev": open("requirements-dev.txt").read().split("\n")},
+    extras_require={
+        "dev": open("requirements-dev.txt").read().split("\n"),
+        "lz4": ["lz4"],
+        "zstd": ["zstandard"],
+        "xxhash": ["xxhash"],
+    },
     tests_require=open("requirements-dev.txt").read().split("\n"),
     classifiers=[
         "Programming Language :: Python :: 2",
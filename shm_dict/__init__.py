@@ -5,4 +5,6 @@ from pkgutil import extend_path
 __path__ = extend_path(__path__, __name__)
 
 from ._version import __version__
+from .shm_bytes_dict import SHMBytesDict
 from .shm_dict import SHMDict
+from .shm_queue import SHMQueue
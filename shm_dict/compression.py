@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+import pickle  # nosec
+import zlib
+
+# Related third party imports (If you used pip/apt/yum to install)
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from ._version import __version__
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle-shm_dict@natrinicle.com"
+__status__ = "Production"
+
+# Values whose pickle is smaller than this are stored as is
+DEFAULT_THRESHOLD = 1024
+
+
+def _codecs():
+    """Map codec names to (compress, decompress) for installed codecs."""
+    codecs = {"zlib": (zlib.compress, zlib.decompress)}
+    if lz4_frame is not None:
+        codecs["lz4"] = (lz4_frame.compress, lz4_frame.decompress)
+    if zstandard is not None:
+        codecs["zstd"] = (
+            lambda data: zstandard.ZstdCompressor().compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data),
+        )
+    return codecs
+
+
+CODECS = _codecs()
+
+
+def check_codec(codec):
+    """Raise a ValueError if codec isn't a known and installed codec.
+
+    :param codec: Codec name, one of zlib, lz4 or zstd.
+    :type codec: :class:`str`
+    """
+    if codec not in CODECS:
+        raise ValueError(
+            "Compression codec {} is not available, choose from {}".format(
+                codec, ", ".join(sorted(CODECS))
+            )
+        )
+
+
+class CompressedValue(object):
+    """A pickled then compressed value as stored in a shared dictionary."""
+
+    __slots__ = ("codec", "data")
+
+    def __init__(self, codec, data):
+        """Standard init method.
+
+        :param codec: Name of the codec data was compressed with.
+        :param data: Compressed pickle of the original value.
+        :type codec: :class:`str`
+        :type data: :class:`bytes`
+        """
+        self.codec = codec
+        self.data = data
+
+    def __reduce__(self):
+        """Pickle as just the codec name and compressed bytes."""
+        return (CompressedValue, (self.codec, self.data))
+
+    def __len__(self):
+        """Return the compressed size in bytes."""
+        return len(self.data)
+
+
+def compress_value(value, codec="zlib", threshold=DEFAULT_THRESHOLD):
+    """Compress a value if its pickle is at least threshold bytes.
+
+    Values that are too small, or that don't get any smaller, are
+    returned unchanged so lookups of them stay a plain dict access.
+
+    :param value: Any picklable value.
+    :param codec: Codec name, one of zlib, lz4 or zstd.
+    :param threshold: Minimum pickled size in bytes worth compressing.
+    :type codec: :class:`str`
+    :type threshold: :class:`int`
+    :return: value or a :class:`CompressedValue`.
+    """
+    if isinstance(value, (bytes, str)) and len(value) < threshold:
+        return value
+
+    pickled = pickle.dumps(value, 2)
+    if len(pickled) < threshold:
+        return value
+
+    compressed = CODECS[codec][0](pickled)
+    if len(compressed) >= len(pickled):
+        return value
+    return CompressedValue(codec, compressed)
+
+
+def decompress_value(value):
+    """Return the original value of a possibly compressed value.
+
+    :param value: A value as stored in a shared dictionary.
+    :raises ValueError: If the codec it was compressed with isn't installed.
+    """
+    if not isinstance(value, CompressedValue):
+        return value
+
+    check_codec(value.codec)
+    return pickle.loads(CODECS[value.codec][1](value.data))  # nosec
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+import hashlib
+import struct
+
+# Related third party imports (If you used pip/apt/yum to install)
+import six
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from ._version import __version__
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle-shm_dict@natrinicle.com"
+__status__ = "Production"
+
+# KeyHasher's default, in hashlib on every supported interpreter so
+# default hashes are the same on all of them
+DEFAULT_HASHER = "sha256"
+
+# Default for new segments, which record their hasher so every process
+# attaching uses the same one. The hashlib hashers are the slow path,
+# the normalised key costs about as much to hash as the pickled key.
+SEGMENT_HASHER = "xxh64" if xxhash is not None else DEFAULT_HASHER
+
+_HASH = struct.Struct("<Q")
+_INT64_LIMIT = 1 << 63
+_LENGTH = struct.Struct("<I")
+
+# Every normalised key starts with a tag for its type, so keys that
+# compare unequal, like "1", b"1" and 1, never normalise the same.
+_TAG_BYTES = b"b"
+_TAG_TEXT = b"s"
+_TAG_INT = b"i"
+_TAG_BIG_INT = b"I"
+_TAG_FLOAT = b"f"
+_TAG_NONE = b"n"
+_TAG_TUPLE = b"t"
+
+_INT64_KEY = struct.Struct("<cq")
+_FLOAT_KEY = struct.Struct("<cd")
+# Tuple elements are preceded by their length
+_TAGGED_LENGTH = struct.Struct("<Ic")
+_TAGGED_INT64 = struct.Struct("<Icq")
+
+
+def _blake2b(seed):
+    """BLAKE2b of the data salted with seed, truncated to 64 bits."""
+    # Copying the salted state is cheaper than salting, or keying, a
+    # new one for every key
+    salted = hashlib.blake2b(digest_size=_HASH.size, salt=_HASH.pack(seed) * 2)
+    copy = salted.copy
+    unpack = _HASH.unpack
+
+    def key_hash(data):
+        digest = copy()
+        digest.update(data)
+        return unpack(digest.digest())[0]
+
+    return key_hash
+
+
+def _sha256(seed):
+    """SHA-256 of the seed followed by the data, truncated to 64 bits."""
+    seeded = hashlib.sha256(_HASH.pack(seed))
+    copy = seeded.copy
+    unpack_from = _HASH.unpack_from
+
+    def key_hash(data):
+        digest = copy()
+        digest.update(data)
+        return unpack_from(digest.digest())[0]
+
+    return key_hash
+
+
+def _xxh64(seed):
+    """xxHash64 of the data with seed."""
+    # A single call where xxhash has it, building a hasher object for
+    # every key costs more than hashing the key
+    intdigest = getattr(xxhash, "xxh64_intdigest", None)
+
+    if intdigest is None:
+
+        def key_hash(data):
+            return xxhash.xxh64(data, seed=seed).intdigest()
+
+    else:
+
+        def key_hash(data):
+            return intdigest(data, seed)
+
+    return key_hash
+
+
+def _hashers():
+    """Map hasher names to factories of seeded hash functions."""
+    hashers = {"sha256": _sha256}
+    if hasattr(hashlib, "blake2b"):
+        hashers["blake2b"] = _blake2b
+    if xxhash is not None:
+        hashers["xxh64"] = _xxh64
+    return hashers
+
+
+# Other hashers can be added under a name of up to 16 ASCII characters,
+# as a callable taking the 64 bit seed and returning a function of bytes
+# to a 64 bit int. Every process using a segment must have it installed.
+HASHERS = _hashers()
+
+
+def check_hasher(hasher):
+    """Raise a ValueError if hasher isn't a known and installed hasher.
+
+    :param hasher: Hasher name, blake2b, sha256, xxh64 or one added to
+                   HASHERS.
+    :type hasher: :class:`str`
+    """
+    if hasher not in HASHERS:
+        raise ValueError(
+            "Key hasher {} is not available, choose from {}".format(
+                hasher, ", ".join(sorted(HASHERS))
+            )
+        )
+
+
+def _normalize_bytes(key):
+    """Normalise a bytes key."""
+    return _TAG_BYTES + key
+
+
+def _normalize_text(key):
+    """Normalise a str key."""
+    return _TAG_TEXT + key.encode("utf-8")
+
+
+def _normalize_int(key):
+    """Normalise an int key, in 8 bytes unless it doesn't fit."""
+    if -_INT64_LIMIT <= key < _INT64_LIMIT:
+        return _INT64_KEY.pack(_TAG_INT, key)
+    return _TAG_BIG_INT + _int_to_bytes(key, (key.bit_length() + 8) // 8)
+
+
+def _normalize_float(key):
+    """Normalise a float key, as an int if it equals one."""
+    if key.is_integer():
+        return _normalize_int(int(key))
+    return _FLOAT_KEY.pack(_TAG_FLOAT, key)
+
+
+def _normalize_none(key):
+    """Normalise a None key."""
+    return _TAG_NONE
+
+
+def _normalize_tuple(key):
+    """Normalise a tuple key element by element, each after its length."""
+    # str and int elements, by far the most common, are packed along
+    # with their length in one go. Concatenating beats joining a list
+    # for the few elements keys have.
+    normalized = _TAG_TUPLE + _LENGTH.pack(len(key))
+    for item in key:
+        item_type = type(item)
+        if item_type is six.text_type:
+            item = item.encode("utf-8")
+            normalized += _TAGGED_LENGTH.pack(len(item) + 1, _TAG_TEXT) + item
+        elif item_type is int and -_INT64_LIMIT <= item < _INT64_LIMIT:
+            normalized += _TAGGED_INT64.pack(_INT64_KEY.size, _TAG_INT, item)
+        else:
+            item = normalize_key(item)
+            normalized += _LENGTH.pack(len(item)) + item
+    return normalized
+
+
+def _int_to_bytes(number, length):
+    """Little endian two's complement bytes of number."""
+    if six.PY2:
+        number &= (1 << (length * 8)) - 1
+        return bytes(bytearray((number >> (8 * i)) & 0xFF for i in range(length)))
+    return number.to_bytes(length, "little", signed=True)
+
+
+# Normaliser of each supported key type, subclasses of them are looked
+# up by isinstance in this order
+_NORMALIZERS = [
+    (six.binary_type, _normalize_bytes),
+    (six.text_type, _normalize_text),
+    (six.integer_types, _normalize_int),
+    (float, _normalize_float),
+    (type(None), _normalize_none),
+    (tuple, _normalize_tuple),
+]
+_TYPE_NORMALIZERS = dict(
+    (key_type, normalizer)
+    for key_types, normalizer in _NORMALIZERS
+    for key_type in (key_types if isinstance(key_types, tuple) else (key_types,))
+)
+_TYPE_NORMALIZERS[bool] = _normalize_int
+
+
+def normalize_key(key):
+    """Encode a key as bytes the same way in every process and interpreter.
+
+    Keys that are equal in a dictionary normalise the same, so 1, 1.0
+    and True do while "1" and b"1" don't. Tuples are normalised element
+    by element.
+
+    :param key: str, bytes, int, float, None or a tuple of them.
+    :rtype: :class:`bytes`
+    :raises TypeError: If key, or anything in it, is of another type.
+    """
+    try:
+        return _TYPE_NORMALIZERS[type(key)](key)
+    except KeyError:
+        pass
+    for key_types, normalizer in _NORMALIZERS:
+        if isinstance(key, key_types):
+            return normalizer(key)
+    raise TypeError(
+        "Keys of type {} can't be hashed stably, use str, bytes, int, float, "
+        "None or tuples of them".format(type(key).__name__)
+    )
+
+
+class KeyHasher(object):
+    """Stable 64 bit key hashes, the same in every process and interpreter.
+
+    Unlike :func:`hash`, which is randomized per interpreter for str and
+    bytes, the hash only depends on the key, the seed and the hasher, so
+    it can be used to lay out or shard keys in shared memory. Keys
+    already encoded as bytes can be hashed with hash_bytes directly.
+    """
+
+    def __init__(self, seed=0, hasher=DEFAULT_HASHER):
+        """Standard init method.
+
+        :param seed: 64 bit seed mixed into every hash.
+        :param hasher: Hasher name, sha256, blake2b, xxh64 or one
+                       added to HASHERS, blake2b needs Python 3.6.
+                       Defaults to sha256, available everywhere, pass
+                       xxh64 for speed.
+        :type seed: :class:`int`
+        :type hasher: :class:`str`
+        """
+        check_hasher(hasher)
+        self.seed = seed
+        self.hasher = hasher
+        self.hash_bytes = HASHERS[hasher](seed)
+
+    def __call__(self, key):
+        """Hash a key of any type :func:`normalize_key` supports.
+
+        :rtype: :class:`int`
+        """
+        return self.hash_bytes(_TYPE_NORMALIZERS.get(type(key), normalize_key)(key))
+
+    def __repr__(self):
+        """Represent the hasher by its name and seed."""
+        return "{}(seed={}, hasher={!r})".format(
+            type(self).__name__, self.seed, self.hasher
+        )
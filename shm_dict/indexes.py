@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+from bisect import bisect_left
+
+# Related third party imports (If you used pip/apt/yum to install)
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from ._version import __version__
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle-shm_dict@natrinicle.com"
+__status__ = "Production"
+
+
+class SecondaryIndex(object):
+    """Index of dictionary keys by a value derived from each entry's value.
+
+    The key function is pickled into shared memory along with the index
+    so every process maintains it, it must therefore be a module level
+    function or something like :func:`operator.itemgetter`. Only
+    processes writing to the dictionary or querying its indexes unpickle
+    them and need to be able to import it. Entries for which it returns
+    None are left out of the index.
+    """
+
+    def __init__(self, key_func):
+        """Standard init method.
+
+        :param key_func: Callable taking a value and returning the
+                         hashable value to index it under.
+        :type key_func: :class:`callable`
+        """
+        self.key_func = key_func
+        self.entries = {}
+        self.buckets = {}
+
+    def add(self, key, value):
+        """Index key under key_func(value), replacing any previous entry."""
+        self.put(key, self.key_func(value))
+
+    def put(self, key, index_value):
+        """Index key under an already computed index_value."""
+        self.remove(key)
+        if index_value is not None:
+            self.entries[key] = index_value
+            self.buckets.setdefault(index_value, set()).add(key)
+
+    def remove(self, key):
+        """Drop key from the index if it is in it."""
+        index_value = self.entries.pop(key, None)
+        if index_value is not None:
+            bucket = self.buckets[index_value]
+            bucket.discard(key)
+            if not bucket:
+                del self.buckets[index_value]
+
+    def clear(self):
+        """Drop every entry from the index."""
+        self.entries.clear()
+        self.buckets.clear()
+
+    def keys_where(self, index_value):
+        """Return the keys indexed under index_value."""
+        return list(self.buckets.get(index_value, ()))
+
+
+class Indexes(object):
+    """Ordered key index and secondary indexes kept alongside a SHMDict."""
+
+    def __init__(self):
+        """Standard init method."""
+        self.keys = None
+        self.secondary = {}
+
+    def __bool__(self):
+        """True if there is any index to maintain."""
+        return self.keys is not None or bool(self.secondary)
+
+    __nonzero__ = __bool__
+
+    def enable_ordered(self, keys):
+        """Start keeping a sorted array of keys.
+
+        :param keys: Every key currently in the dictionary.
+        """
+        self.keys = sorted(keys)
+
+    def add_secondary(self, name, key_func, items):
+        """Create, or rebuild, a secondary index.
+
+        :param name: Name to query the index by.
+        :param key_func: See :class:`SecondaryIndex`.
+        :param items: Every (key, value) currently in the dictionary.
+        """
+        index = SecondaryIndex(key_func)
+        for key, value in items:
+            index.add(key, value)
+        self.secondary[name] = index
+
+    def rebuild(self, items):
+        """Rebuild every index from scratch, keeping their definitions.
+
+        :param items: Every (key, value) now in the dictionary.
+        """
+        if self.keys is not None:
+            self.keys = sorted(set(key for key, _ in items))
+        for name, index in list(self.secondary.items()):
+            self.add_secondary(name, index.key_func, items)
+
+    def set(self, key, value):
+        """Update every index for key being set to value.
+
+        Keys that can't be ordered against the others, and values a
+        key_func fails on, raise before any index is changed.
+        """
+        position = None
+        if self.keys is not None:
+            position = bisect_left(self.keys, key)
+        index_values = [
+            (index, index.key_func(value)) for index in self.secondary.values()
+        ]
+
+        if position is not None and (
+            position == len(self.keys) or self.keys[position] != key
+        ):
+            self.keys.insert(position, key)
+        for index, index_value in index_values:
+            index.put(key, index_value)
+
+    def delete(self, key):
+        """Update every index for key being deleted."""
+        if self.keys is not None:
+            position = bisect_left(self.keys, key)
+            if position < len(self.keys) and self.keys[position] == key:
+                del self.keys[position]
+        for index in self.secondary.values():
+            index.remove(key)
+
+    def clear(self):
+        """Empty every index, keeping their definitions."""
+        if self.keys is not None:
+            self.keys = []
+        for index in self.secondary.values():
+            index.clear()
+
+
+def keys_in_range(sorted_keys, low=None, high=None):
+    """Return the keys k of a sorted list with low <= k < high.
+
+    :param sorted_keys: Sorted list of keys.
+    :param low: Inclusive lower bound or None for no lower bound.
+    :param high: Exclusive upper bound or None for no upper bound.
+    """
+    start = 0 if low is None else bisect_left(sorted_keys, low)
+    end = len(sorted_keys) if high is None else bisect_left(sorted_keys, high)
+    return sorted_keys[start:end]
+
+
+def keys_with_prefix(sorted_keys, prefix):
+    """Return the str or bytes keys of a sorted list starting with prefix.
+
+    :param sorted_keys: Sorted list of keys.
+    :param prefix: Prefix to match.
+    """
+    matches = []
+    for position in range(bisect_left(sorted_keys, prefix), len(sorted_keys)):
+        key = sorted_keys[position]
+        if not key.startswith(prefix):
+            break
+        matches.append(key)
+    return matches
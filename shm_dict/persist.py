@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+import io
+import mmap
+import os
+import pickle  # nosec
+import struct
+
+# Related third party imports (If you used pip/apt/yum to install)
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from ._version import __version__
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle-shm_dict@natrinicle.com"
+__status__ = "Production"
+
+# Indexed persist files are laid out as
+#   INDEX_MAGIC, pickled value, pickled value, ..., pickled index, footer
+# where the index maps each key to the (offset, length) of its value and
+# the footer holds the (offset, length) of the index and INDEX_MAGIC again.
+INDEX_MAGIC = b"SHMDIDX1"
+
+_FOOTER = struct.Struct("<QQ8s")
+
+# Streams are laid out as
+#   STREAM_MAGIC, version, chunk, chunk, ..., end chunk
+# where each chunk is its entry count and byte length followed by that
+# many pickled (key, value) pairs, and the end chunk has no entries.
+STREAM_MAGIC = b"SHMDSTRM"
+STREAM_VERSION = 1
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_STREAM_HEADER = struct.Struct("<8sH")
+_CHUNK_HEADER = struct.Struct("<IQ")
+
+
+def dump_indexed(mapping, path):
+    """Write mapping to path in the indexed persist file format.
+
+    The file is written next to path and renamed into place so readers,
+    including ones with the old file mapped, never see a partial write.
+
+    :param mapping: Dictionary or mapping to write out.
+    :param path: Destination file path.
+    :type mapping: :class:`collections.abc.Mapping`
+    :type path: :class:`str`
+    """
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    index = {}
+    with open(tmp_path, "wb") as pfile:
+        pfile.write(INDEX_MAGIC)
+        offset = len(INDEX_MAGIC)
+        for key in mapping:
+            value = pickle.dumps(mapping[key], 2)
+            pfile.write(value)
+            index[key] = (offset, len(value))
+            offset += len(value)
+
+        index_data = pickle.dumps(index, 2)
+        pfile.write(index_data)
+        pfile.write(_FOOTER.pack(offset, len(index_data), INDEX_MAGIC))
+    os.rename(tmp_path, path)
+
+
+def dump_stream(items, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write (key, value) pairs to a file object in the stream format.
+
+    Entries are pickled and written a chunk at a time so memory use is
+    bounded by chunk_size however many entries there are.
+
+    :param items: Iterable of (key, value) pairs.
+    :param fileobj: Binary file object to write to.
+    :param chunk_size: Bytes of pickled entries to collect per chunk.
+    :type fileobj: :class:`io.BufferedIOBase`
+    :type chunk_size: :class:`int`
+    :return: Number of entries written.
+    """
+    fileobj.write(_STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION))
+    written = 0
+    chunk = []
+    chunk_len = 0
+    for item in items:
+        entry = pickle.dumps(tuple(item), 2)
+        chunk.append(entry)
+        chunk_len += len(entry)
+        if chunk_len >= chunk_size:
+            fileobj.write(_CHUNK_HEADER.pack(len(chunk), chunk_len))
+            fileobj.write(b"".join(chunk))
+            written += len(chunk)
+            chunk = []
+            chunk_len = 0
+
+    if chunk:
+        fileobj.write(_CHUNK_HEADER.pack(len(chunk), chunk_len))
+        fileobj.write(b"".join(chunk))
+        written += len(chunk)
+    fileobj.write(_CHUNK_HEADER.pack(0, 0))
+    return written
+
+
+def load_stream(fileobj):
+    """Yield the (key, value) pairs of a stream written by :func:`dump_stream`.
+
+    :param fileobj: Binary file object to read from.
+    :type fileobj: :class:`io.BufferedIOBase`
+    :raises ValueError: If the stream isn't in a supported version of the
+                        format or ends early.
+    """
+    header = fileobj.read(_STREAM_HEADER.size)
+    if len(header) != _STREAM_HEADER.size:
+        raise ValueError("Stream ended before its header")
+    magic, version = _STREAM_HEADER.unpack(header)
+    if magic != STREAM_MAGIC:
+        raise ValueError("Not a shm_dict stream")
+    if version != STREAM_VERSION:
+        raise ValueError(
+            "Stream version {} is not supported, expected {}".format(
+                version, STREAM_VERSION
+            )
+        )
+
+    while True:
+        chunk_header = fileobj.read(_CHUNK_HEADER.size)
+        if len(chunk_header) != _CHUNK_HEADER.size:
+            raise ValueError("Stream ended before its end chunk")
+        count, chunk_len = _CHUNK_HEADER.unpack(chunk_header)
+        if count == 0:
+            return
+
+        chunk = fileobj.read(chunk_len)
+        if len(chunk) != chunk_len:
+            raise ValueError("Stream ended part way through a chunk")
+        chunk_file = io.BytesIO(chunk)
+        for _ in range(count):
+            yield pickle.load(chunk_file)  # nosec
+
+
+def load_persist_file(path):
+    """Open a persist file, lazily if it is in the indexed format.
+
+    Files written before the indexed format existed are a single pickled
+    dictionary and are loaded in full.
+
+    :param path: Persist file path.
+    :type path: :class:`str`
+    :return: A :class:`LazyDict` or a :class:`dict`.
+    :raises IOError: If the file can't be opened.
+    """
+    with open(path, "rb") as pfile:
+        if pfile.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            pfile.seek(0)
+            return pickle.load(pfile)  # nosec
+    return LazyDict(path)
+
+
+class LazyDict(MutableMapping):
+    """Dictionary backed by an indexed persist file.
+
+    Only the key index is read when opened, values are unpickled from
+    the memory mapped file the first time they are accessed. Pickling a
+    LazyDict produces a plain :class:`dict` pickle.
+    """
+
+    def __init__(self, path):
+        """Map path and read its key index.
+
+        :param path: Indexed persist file path.
+        :type path: :class:`str`
+        """
+        self._values = {}
+        with open(path, "rb") as pfile:
+            self._map_file = mmap.mmap(pfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index_offset, index_len, magic = _FOOTER.unpack_from(
+            self._map_file, len(self._map_file) - _FOOTER.size
+        )
+        if magic != INDEX_MAGIC:
+            self._map_file.close()
+            raise pickle.UnpicklingError("{} has no key index".format(path))
+        self._index = pickle.loads(  # nosec
+            self._map_file[index_offset : index_offset + index_len]
+        )
+        self.__close_when_loaded()
+
+    def __close_when_loaded(self):
+        """Release the file mapping once every value is in memory."""
+        if not self._index and self._map_file is not None:
+            self._map_file.close()
+            self._map_file = None
+
+    def __getitem__(self, key):
+        """Return a value, unpickling it from the file on first access."""
+        try:
+            return self._values[key]
+        except KeyError:
+            offset, length = self._index.pop(key)
+
+        value = pickle.loads(self._map_file[offset : offset + length])  # nosec
+        self._values[key] = value
+        self.__close_when_loaded()
+        return value
+
+    def __setitem__(self, key, value):
+        """Set a key to a value, shadowing any value still in the file."""
+        self._index.pop(key, None)
+        self._values[key] = value
+        self.__close_when_loaded()
+
+    def __delitem__(self, key):
+        """Remove a key whether or not its value was loaded."""
+        if key in self._values:
+            del self._values[key]
+        else:
+            del self._index[key]
+            self.__close_when_loaded()
+
+    def __contains__(self, key):
+        """Check for a key without loading its value."""
+        return key in self._values or key in self._index
+
+    def __iter__(self):
+        """Iterate over a snapshot of the keys without loading values."""
+        return iter(list(self._values) + list(self._index))
+
+    def __len__(self):
+        """Return the number of keys, loaded or not."""
+        return len(self._values) + len(self._index)
+
+    def __repr__(self):
+        """Represent the dictionary with every value loaded."""
+        return repr(self.copy())
+
+    def __reduce__(self):
+        """Pickle as a plain dictionary."""
+        return (dict, (self.copy(),))
+
+    @property
+    def loaded(self):
+        """True once every value has been read from the file."""
+        return not self._index
+
+    def clear(self):
+        """Remove every key without loading any values."""
+        self._values.clear()
+        self._index.clear()
+        self.__close_when_loaded()
+
+    def copy(self):
+        """Load every value and return them as a plain dictionary."""
+        return dict((key, self[key]) for key in self)
@@ -0,0 +1,935 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+import base64
+from collections import namedtuple
+from contextlib import contextmanager
+import hashlib
+import heapq
+import logging
+import mmap
+from operator import itemgetter
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+
+# Related third party imports (If you used pip/apt/yum to install)
+import posix_ipc
+import six
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from ._version import __version__
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle-shm_dict@natrinicle.com"
+__status__ = "Production"
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# Every shared memory segment starts with this common header, a magic
+# identifying which kind of container owns the segment, that container's
+# layout version and the number of attached handles. Containers keep
+# their own header fields from SUBHEADER_OFFSET onwards.
+SUBHEADER_OFFSET = 16
+
+_HEADER = struct.Struct("<4sHxxI")
+_Header = namedtuple("_Header", ["magic", "layout", "attach_count"])
+_FRESH_MAGIC = b"\x00" * 4
+
+# madvise hint for each supported access pattern
+_ACCESS_ADVICE = {"sequential": "MADV_SEQUENTIAL", "random": "MADV_RANDOM"}
+
+# Seconds multi_lock waits for a semaphore while holding others, and the
+# longest it backs off for before retrying the whole set.
+_MULTI_LOCK_BACKOFF = 0.01
+_MULTI_LOCK_MAX_BACKOFF = 0.5
+
+SegmentUsage = namedtuple("SegmentUsage", ["capacity", "used"])
+MemoryStats = namedtuple(
+    "MemoryStats",
+    [
+        "segment_size",
+        "used",
+        "slack",
+        "garbage",
+        "fragmentation",
+        "payload_bytes",
+        "entries",
+        "largest_keys",
+    ],
+)
+
+# Where Linux exposes POSIX shared memory, semaphores included
+SHM_DIR = "/dev/shm"
+
+# Names made by _safe_name, the base64 of a SHA512 digest, which Python
+# 3 formats as a bytes literal
+_SAFE_NAME = re.compile(r"^(?:b')?[A-Za-z0-9_-]{86}==(?:')?$")
+_SEMAPHORE_PREFIX = "sem."
+
+SegmentInfo = namedtuple(
+    "SegmentInfo", ["name", "label", "kind", "size", "attach_count"]
+)
+SemaphoreInfo = namedtuple("SemaphoreInfo", ["name", "label", "value"])
+IPCObjects = namedtuple("IPCObjects", ["segments", "semaphores"])
+
+
+def _hash_name(prefix, name):
+    """IPC object safe name for the segment called name.
+
+    :param prefix: A string to prepend followed by _ and then the name.
+    :param name: Segment name.
+    :type prefix: :class:`str`
+    """
+    # Hash lengths
+    # SHA1: 28
+    # SHA256: 44
+    # SHA512: 88
+    sha_hash = hashlib.sha512()
+    sha_hash.update("_".join([prefix, str(name)]).encode("utf-8"))
+    b64_encode = base64.urlsafe_b64encode(sha_hash.digest())
+    return "/{}".format(b64_encode)
+
+
+def _segment_kinds():
+    """Map the segment_magic of every container class to its name."""
+    kinds = {}
+    pending = [SHMSegment]
+    while pending:
+        cls = pending.pop()
+        kinds.setdefault(cls.segment_magic, cls.__name__)
+        pending.extend(cls.__subclasses__())
+    return kinds
+
+
+def _read_segment_info(path):
+    """Return (kind magic, size, attach count) of a segment file.
+
+    The magic and attach count are None if the header can't be read.
+    """
+    with open(path, "rb") as shm_file:
+        size = os.fstat(shm_file.fileno()).st_size
+        data = shm_file.read(_HEADER.size)
+    if len(data) < _HEADER.size:
+        return None, size, None
+    header = _Header(*_HEADER.unpack(data))
+    return header.magic, size, header.attach_count
+
+
+def list_ipc_objects(names=(), shm_dir=SHM_DIR):
+    """List the shared memory segments and semaphores of this package.
+
+    Finds every IPC object on the host named the way this package names
+    them, live or left behind by a process that never closed its
+    handles. Hashed names can't be turned back into segment names, pass
+    the names to look for to have their objects labelled with them.
+
+    :param names: Segment names, as passed to the containers, to label
+                  objects with.
+    :param shm_dir: Directory the system exposes shared memory in.
+    :type shm_dir: :class:`str`
+    :rtype: :class:`IPCObjects` of :class:`SegmentInfo` and
+            :class:`SemaphoreInfo` lists sorted by name.
+    """
+    labels = {}
+    for name in names:
+        labels[_hash_name("shm", name)] = name
+        labels[_hash_name("sem", name)] = name
+    kinds = _segment_kinds()
+
+    segments = []
+    semaphores = []
+    for entry in sorted(os.listdir(shm_dir)):
+        is_semaphore = entry.startswith(_SEMAPHORE_PREFIX)
+        if is_semaphore:
+            entry = entry[len(_SEMAPHORE_PREFIX) :]
+        if _SAFE_NAME.match(entry) is None:
+            continue
+
+        ipc_name = "/{}".format(entry)
+        label = labels.get(ipc_name)
+        try:
+            if is_semaphore:
+                semaphore = posix_ipc.Semaphore(ipc_name)
+                value = semaphore.value if posix_ipc.SEMAPHORE_VALUE_SUPPORTED else None
+                semaphore.close()
+                semaphores.append(SemaphoreInfo(ipc_name, label, value))
+            else:
+                magic, size, attach_count = _read_segment_info(
+                    os.path.join(shm_dir, entry)
+                )
+                segments.append(
+                    SegmentInfo(ipc_name, label, kinds.get(magic), size, attach_count)
+                )
+        except (posix_ipc.ExistentialError, IOError, OSError):
+            # Unlinked since it was listed
+            continue
+    return IPCObjects(segments, semaphores)
+
+
+class SHMSegment(object):
+    """Named shared memory segment guarded by a named semaphore.
+
+    Handles the IPC object naming, creation, attach counting and
+    teardown shared by the containers in this package. Subclasses set
+    segment_magic and segment_layout and build on :meth:`exclusive_lock`.
+    """
+
+    segment_magic = b"SHMS"
+    segment_layout = 1
+
+    def __init__(
+        self,
+        name,
+        lock_timeout=30,
+        auto_unlock=False,
+        readonly=False,
+        preallocate=None,
+        populate=False,
+        huge_pages=False,
+        access=None,
+    ):
+        """Standard init method.
+
+        :param name: Name for shared memory and semaphore.
+        :param lock_timeout: Time in seconds before giving up on
+                             acquiring an exclusive lock to the
+                             segment.
+        :param auto_unlock: If the lock_timeout is hit, and this
+                            is True, automatically bypass the
+                            lock and use the segment anyway.
+        :param readonly: Attach to an already existing shared memory
+                         segment without ever creating, resizing,
+                         writing into or unlinking it. Raises
+                         :class:`posix_ipc.ExistentialError` if the
+                         segment does not exist yet.
+        :param preallocate: Grow the segment to at least this many bytes
+                            when attaching so it doesn't have to be
+                            remapped as the contents grow.
+        :param populate: Pre-fault the mapping, and anything it grows
+                         into, instead of faulting pages in on first
+                         touch.
+        :param huge_pages: Ask for transparent huge pages to back the
+                           mapping, where the kernel allows it for
+                           shared memory.
+        :param access: Expected access pattern, "sequential" or
+                       "random", passed on to the kernel's read ahead.
+        :type name: :class:`str`
+        :type lock_timeout: :class:`int` or :class:`float`
+        :type auto_unlock: :class:`bool`
+        :type readonly: :class:`bool`
+        :type preallocate: :class:`int` or None
+        :type populate: :class:`bool`
+        :type huge_pages: :class:`bool`
+        :type access: :class:`str` or None
+        """
+        if access is not None and access not in _ACCESS_ADVICE:
+            raise ValueError(
+                "access must be one of {}, not {!r}".format(
+                    ", ".join(sorted(_ACCESS_ADVICE)), access
+                )
+            )
+
+        self._closed = False
+        self.name = name
+        self.lock_timeout = lock_timeout
+        self.auto_unlock = auto_unlock
+        self.readonly = readonly
+        self.preallocate = preallocate
+        self.populate = populate
+        self.huge_pages = huge_pages
+        self.access = access
+        self.owner = False
+        self._safe_names = {}
+        self._semaphore = None
+        self._shared_mem = None
+        self._map_file = None
+        # Process that attached, forked children inherit the handle but
+        # never counted themselves in the attach count
+        self._attach_pid = None
+        # Threads sharing this handle take the mutex before the semaphore
+        self._mutex = threading.RLock()
+        self._mutex_owner = None
+        self._mutex_count = 0
+        self._semaphore_locked = False
+        self._lock_depth = 0
+
+        # Nothing touches the IPC objects until the handle is first used,
+        # short lived handles that never are cost no system calls.
+        if self.readonly is True:
+            # Fail fast rather than creating a segment nobody will write to
+            self._attach()
+
+        super(SHMSegment, self).__init__()
+
+    def _safe_name(self, prefix=""):
+        """IPC object safe name creator.
+
+        Semaphores and Shared Mmeory names allow up to 256 characters (dependong on OS) and must
+        begin with a /.
+
+        Names are cached per handle as they are needed for every IPC
+        call and for equality checks.
+
+        :param prefix: A string to prepend followed by _ and
+                       then the segment's name.
+        :type prefix: :class:`str`
+        """
+        cache_key = (prefix, self.name)
+        try:
+            return self._safe_names[cache_key]
+        except KeyError:
+            safe_name = self._safe_names[cache_key] = _hash_name(prefix, self.name)
+            return safe_name
+
+    @property
+    def safe_sem_name(self):
+        """Unique semaphore name based on the segment name."""
+        return self._safe_name("sem")
+
+    @property
+    def safe_shm_name(self):
+        """Unique shared memory segment name based on the segment name."""
+        return self._safe_name("shm")
+
+    @property
+    def semaphore(self):
+        """Create or return already existing semaphore."""
+        if self._semaphore is not None:
+            return self._semaphore
+
+        try:
+            self._semaphore = posix_ipc.Semaphore(self.safe_sem_name)
+        except posix_ipc.ExistentialError:
+            if self.readonly is True:
+                six.reraise(*sys.exc_info())
+            self._semaphore = posix_ipc.Semaphore(
+                self.safe_sem_name, flags=posix_ipc.O_CREAT, initial_value=1
+            )
+        return self._semaphore
+
+    @property
+    def shared_mem(self):
+        """Create or return already existing shared memory object."""
+        if self._shared_mem is None:
+            self._attach()
+        return self._shared_mem
+
+    @property
+    def map_file(self):
+        """Create or return mmap file remapping if another handle resized it."""
+        if self._map_file is None:
+            self._attach()
+        elif len(self._map_file) != self._map_file.size():
+            self._map_file.close()
+            self._map_file = self._mmap()
+        return self._map_file
+
+    @property
+    def attach_count(self):
+        """Number of handles, in any process, attached to the segment."""
+        with self._semaphore_held():
+            if self._map_file is None:
+                self._attach()
+            return self._read_header().attach_count
+
+    def _inherited(self):
+        """True if this handle was attached by the process that forked this one."""
+        return self._attach_pid is not None and self._attach_pid != os.getpid()
+
+    def _check_open(self):
+        """Raise a ValueError if this handle has been closed."""
+        if self._closed is True:
+            raise ValueError("{} {} is closed".format(type(self).__name__, self.name))
+
+    def _check_writable(self):
+        """Raise a TypeError if this handle was attached read only."""
+        if self.readonly is True:
+            raise TypeError(
+                "{} {} is attached read only".format(type(self).__name__, self.name)
+            )
+
+    def _acquire_mutex(self, timeout=None):
+        """Take the in-process mutex threads sharing this handle queue on.
+
+        :param timeout: Seconds to wait, defaults to lock_timeout. Without
+                        an explicit timeout auto_unlock handles wait as
+                        long as it takes, bypassing the mutex would let
+                        threads corrupt this handle's state.
+        :type timeout: :class:`int` or :class:`float`
+        :raises posix_ipc.BusyError: If another thread kept it too long.
+        """
+        if timeout is None:
+            timeout = None if self.auto_unlock is True else self.lock_timeout
+
+        if timeout is None:
+            acquired = self._mutex.acquire()
+        elif timeout <= 0:
+            acquired = self._mutex.acquire(False)
+        elif six.PY2:
+            # Python 2 locks can't time out
+            acquired = self._mutex.acquire()
+        else:
+            acquired = self._mutex.acquire(True, timeout)
+        if not acquired:
+            raise posix_ipc.BusyError(
+                "{} {} is locked by another thread".format(
+                    type(self).__name__, self.name
+                )
+            )
+        self._mutex_owner = threading.current_thread()
+        self._mutex_count += 1
+
+    def _release_mutex(self):
+        """Hand back one hold of the in-process mutex."""
+        self._mutex_count -= 1
+        if self._mutex_count == 0:
+            self._mutex_owner = None
+        self._mutex.release()
+
+    def _owns_mutex(self):
+        """True if the current thread holds the in-process mutex."""
+        return self._mutex_owner is threading.current_thread()
+
+    def _holds_lock(self):
+        """True if the current thread holds an exclusive lock on the segment."""
+        return self._lock_depth > 0 and self._owns_mutex()
+
+    @contextmanager
+    def _semaphore_held(self):
+        """Hold the semaphore without any of the subclass' lock handling."""
+        self._acquire_mutex()
+        try:
+            if self._semaphore_locked is True:
+                yield
+            else:
+                self._acquire_semaphore()
+                try:
+                    yield
+                finally:
+                    self._release_semaphore()
+        finally:
+            self._release_mutex()
+
+    def _acquire_semaphore(self):
+        """Acquire the semaphore honoring lock_timeout and auto_unlock."""
+        try:
+            self.semaphore.acquire(self.lock_timeout)
+            self._semaphore_locked = True
+        except posix_ipc.BusyError:
+            if self.auto_unlock is True:
+                self._semaphore_locked = True
+            else:
+                six.reraise(*sys.exc_info())
+
+    def _release_semaphore(self):
+        """Release the semaphore if this handle holds it."""
+        if self._semaphore_locked is True:
+            self._semaphore_locked = False
+            self.semaphore.release()
+
+    def _acquire_lock(self):
+        """Acquire an exclusive segment lock.
+
+        Threads sharing the handle wait on an in-process mutex first so
+        only one of them at a time goes on to the semaphore. Locks nest,
+        only the outermost one calls :meth:`_lock_outermost`.
+
+        .. warnings also::
+            MacOS has a number of shortcomings with regards to
+            semaphores and shared memory segments, this is one
+            method contains one of them.
+
+                When the timeout is > 0, the call will wait no longer than
+                timeout seconds before either returning (having acquired
+                the semaphore) or raising a BusyError.
+                On platforms that don't support the sem_timedwait() API,
+                a timeout > 0 is treated as infinite. The call will not
+                return until its wait condition is satisfied.
+                Most platforms provide sem_timedwait(). macOS is a notable
+                exception. The module's Boolean constant
+                SEMAPHORE_TIMEOUT_SUPPORTED is True on platforms that
+                support sem_timedwait().
+
+                -- http://semanchuk.com/philip/posix_ipc/
+        """
+        self._check_open()
+        self._acquire_mutex()
+        try:
+            if self._lock_depth == 0:
+                self._lock_outermost()
+        except Exception:
+            self._release_mutex()
+            raise
+        self._lock_depth += 1
+
+    def _lock_outermost(self):
+        """Take the semaphore for the outermost lock.
+
+        Subclasses extend this to load their state once the semaphore is
+        held, handing it back with :meth:`_release_semaphore` if that
+        fails.
+        """
+        if self._semaphore_locked is False:
+            self._acquire_semaphore()
+
+    def _release_lock(self, failed=False):
+        """Release the exclusive lock, and the semaphore once the outermost lock exits.
+
+        :param failed: True if an exception is escaping the locked block.
+        :type failed: :class:`bool`
+        """
+        if not self._holds_lock():
+            return
+
+        try:
+            if self._lock_depth == 1:
+                self._unlock_outermost(failed)
+        finally:
+            self._lock_depth -= 1
+            self._release_mutex()
+
+    def _unlock_outermost(self, failed=False):
+        """Hand back the semaphore as the outermost lock exits.
+
+        Subclasses extend this to save their state before it is released,
+        or to drop it if failed is True.
+
+        :param failed: True if an exception is escaping the locked block.
+        :type failed: :class:`bool`
+        """
+        self._release_semaphore()
+
+    @contextmanager
+    def exclusive_lock(self):
+        """A context manager for the lock to allow with statements for exclusive access.
+
+        Locks nest, only the outermost one acquires and releases the
+        semaphore. Containers caching their contents in the handle drop
+        the changes made under the lock if an exception escapes the
+        outermost one, rather than saving them half made.
+        """
+        self._acquire_lock()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self._release_lock(failed)
+
+    @staticmethod
+    @contextmanager
+    def multi_lock(*segments, **kwargs):
+        """Hold the exclusive lock of several segments at once.
+
+        Semaphores are taken in order of their names so every process
+        locks shared segments in the same order. If one is busy, every
+        semaphore taken so far is handed back and the whole set retried
+        after a randomized back off, so processes nesting
+        :meth:`exclusive_lock` in another order can't deadlock with it
+        either. Each segment is locked once however often it is passed,
+        so an SHMDict is loaded on entry and saved on exit only once.
+
+        :param segments: Segments to lock, any mix of containers.
+        :param timeout: Seconds to keep retrying before raising
+                        :class:`posix_ipc.BusyError`, defaults to the
+                        longest lock_timeout of the segments.
+        :type timeout: :class:`int` or :class:`float`
+        :raises ValueError: If two different handles to the same
+                            segment are passed.
+        """
+        timeout = kwargs.pop("timeout", None)
+        if kwargs:
+            raise TypeError(
+                "Unexpected keyword arguments {}".format(", ".join(sorted(kwargs)))
+            )
+
+        by_name = {}
+        for segment in segments:
+            other = by_name.setdefault(segment.safe_sem_name, segment)
+            if other is not segment:
+                raise ValueError(
+                    "{} is passed through more than one handle".format(segment.name)
+                )
+        ordered = [by_name[name] for name in sorted(by_name)]
+        if timeout is None:
+            timeout = max([segment.lock_timeout for segment in ordered] + [0])
+
+        held = [segment for segment in ordered if segment._holds_lock()]
+        deadline = time.time() + timeout
+        backoff = _MULTI_LOCK_BACKOFF
+        while True:
+            taken = []
+            try:
+                for segment in ordered:
+                    segment._check_open()
+                    if segment in held:
+                        continue
+                    # Only block for long while holding nothing
+                    wait = max(deadline - time.time(), 0)
+                    if taken or held:
+                        wait = min(wait, _MULTI_LOCK_BACKOFF)
+                    segment._acquire_mutex(wait)
+                    taken.append(segment)
+                    segment.semaphore.acquire(wait)
+                    segment._semaphore_locked = True
+                break
+            except posix_ipc.BusyError:
+                for segment in reversed(taken):
+                    segment._release_semaphore()
+                    segment._release_mutex()
+                if time.time() >= deadline:
+                    six.reraise(*sys.exc_info())
+                time.sleep(random.uniform(0, backoff))  # nosec
+                backoff = min(backoff * 2, _MULTI_LOCK_MAX_BACKOFF)
+
+        locked = []
+        try:
+            for segment in ordered:
+                segment._acquire_lock()
+                locked.append(segment)
+        except Exception:
+            exc_info = sys.exc_info()
+            try:
+                for segment in reversed(locked):
+                    segment._release_lock()
+                for segment in taken:
+                    if segment not in locked:
+                        segment._release_semaphore()
+                six.reraise(*exc_info)
+            finally:
+                del exc_info
+        finally:
+            # Every lock is now held through _acquire_lock's own mutex hold
+            for segment in taken:
+                segment._release_mutex()
+
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            exc_info = None
+            try:
+                for segment in reversed(locked):
+                    try:
+                        segment._release_lock(failed)
+                    except Exception:
+                        exc_info = exc_info or sys.exc_info()
+                if exc_info is not None:
+                    six.reraise(*exc_info)
+            finally:
+                del exc_info
+
+    def _mmap(self):
+        """Map the whole shared memory segment, read only if requested."""
+        prot = mmap.PROT_READ
+        if self.readonly is not True:
+            prot |= mmap.PROT_WRITE
+        flags = mmap.MAP_SHARED
+        if self.populate is True:
+            flags |= getattr(mmap, "MAP_POPULATE", 0)
+        map_file = mmap.mmap(self._shared_mem.fd, 0, flags=flags, prot=prot)
+        self._advise(map_file, 0)
+        return map_file
+
+    def _advise(self, map_file, start):
+        """Pass the configured hints on for the mapping from start onwards.
+
+        The hints are best effort, ones the platform or kernel doesn't
+        support are skipped.
+
+        :param map_file: Mapping to advise on.
+        :param start: Page aligned offset to advise from.
+        :type map_file: :class:`mmap.mmap`
+        :type start: :class:`int`
+        """
+        advice = []
+        if self.huge_pages is True:
+            advice.append("MADV_HUGEPAGE")
+        if self.access is not None:
+            advice.append(_ACCESS_ADVICE[self.access])
+        if self.populate is True and start > 0:
+            # MAP_POPULATE only covers what was mapped at the time
+            advice.append("MADV_WILLNEED")
+
+        length = len(map_file) - start
+        if length <= 0 or not hasattr(map_file, "madvise"):
+            return
+        for name in advice:
+            option = getattr(mmap, name, None)
+            if option is None:
+                continue
+            try:
+                map_file.madvise(option, start, length)
+            except OSError as err:
+                logger.debug("Ignoring %s for %s: %s", name, self.name, err)
+
+    def _attach(self):
+        """Open or create the segment, map it and bump its attach count.
+
+        Done while holding the semaphore so a peer dropping the attach
+        count to zero can't unlink the segment between it being opened
+        and this handle being counted.
+
+        That peer unlinks the semaphore too, so a handle which opened it
+        beforehand and was waiting on it gets a semaphore nobody else
+        will find by name. Before creating a segment the semaphore is
+        therefore opened again by name, or created. A whole create,
+        attach and close cycle fitting between opening that one and
+        getting it would still leave this handle on an orphan.
+        """
+        self._check_open()
+        with self._semaphore_held():
+            reopened = False
+            while self._shared_mem is None:
+                try:
+                    self._shared_mem = posix_ipc.SharedMemory(self.safe_shm_name)
+                except posix_ipc.ExistentialError:
+                    if self.readonly is True:
+                        six.reraise(*sys.exc_info())
+                    if reopened is False:
+                        self._reopen_semaphore()
+                        reopened = True
+                        continue
+                    try:
+                        self._shared_mem = posix_ipc.SharedMemory(
+                            self.safe_shm_name,
+                            flags=posix_ipc.O_CREX,
+                            size=posix_ipc.PAGE_SIZE,
+                        )
+                        self.owner = True
+                    except posix_ipc.ExistentialError:
+                        # Lost the race to create it, open the winner's segment
+                        continue
+
+            self._map_file = self._mmap()
+            magic = self._map_file[:4]
+            if magic == _FRESH_MAGIC and self.readonly is not True:
+                self._initialize_segment()
+            elif magic not in (_FRESH_MAGIC, self.segment_magic):
+                self._map_file.close()
+                self._map_file = None
+                self._shared_mem.close_fd()
+                self._shared_mem = None
+                raise ValueError(
+                    "Segment for {} was not created by a {}".format(
+                        self.name, type(self).__name__
+                    )
+                )
+            self._write_attach_count(self._read_header().attach_count + 1)
+            self._attach_pid = os.getpid()
+            if self.preallocate is not None and self.readonly is not True:
+                self._resize(self.preallocate)
+
+    def _reopen_semaphore(self):
+        """Swap the held semaphore for the one now found under its name."""
+        self._release_semaphore()
+        self._semaphore.close()
+        self._semaphore = None
+        self._acquire_semaphore()
+
+    def _initialize_segment(self):
+        """Lay out a freshly created segment.
+
+        Subclasses extend this to set up their own header fields, the
+        common header is written last so the magic only appears once the
+        segment is ready.
+        """
+        header = _Header(self.segment_magic, self.segment_layout, 0)
+        self._map_file[: _HEADER.size] = _HEADER.pack(*header)
+
+    def _read_header(self):
+        """Read the common segment header, a fresh segment reads as empty."""
+        header = _Header(*_HEADER.unpack_from(self._map_file, 0))
+        if header.magic == _FRESH_MAGIC:
+            header = _Header(self.segment_magic, self.segment_layout, 0)
+        elif header.layout != self.segment_layout:
+            raise ValueError(
+                "Segment for {} uses layout {}, expected {}".format(
+                    self.name, header.layout, self.segment_layout
+                )
+            )
+        return header
+
+    def _write_attach_count(self, attach_count):
+        """Write the attach count into the common header.
+
+        Read only handles have the segment mapped PROT_READ but still
+        keep the attach count accurate, so they write through the fd.
+        """
+        header = self._read_header()._replace(attach_count=attach_count)
+        packed = _HEADER.pack(*header)
+        if self.readonly is True:
+            os.lseek(self._shared_mem.fd, 0, os.SEEK_SET)
+            os.write(self._shared_mem.fd, packed)
+        else:
+            self._map_file[: _HEADER.size] = packed
+
+    def _resize(self, size):
+        """Grow the segment to hold at least size bytes.
+
+        Segments never shrink and grow to at least double their size,
+        rounded up to a whole page, so a growing container only remaps
+        a logarithmic number of times.
+
+        :param size: Minimum number of bytes the segment must hold.
+        :type size: :class:`int`
+        """
+        map_file = self.map_file
+        old_size = len(map_file)
+        if size <= old_size:
+            return map_file
+
+        size = max(size, old_size * 2)
+        map_file.resize(int(-(-size // mmap.PAGESIZE) * mmap.PAGESIZE))
+        self._advise(map_file, old_size)
+        return map_file
+
+    def _used_bytes(self):
+        """Bytes of the segment in use, subclasses count their contents."""
+        return SUBHEADER_OFFSET
+
+    def usage(self):
+        """Return the segment's capacity and how many bytes of it are in use.
+
+        :rtype: :class:`SegmentUsage`
+        """
+        with self._semaphore_held():
+            return SegmentUsage(len(self.map_file), self._used_bytes())
+
+    def _memory_stats(self, payload_bytes, entries, entry_sizes, garbage=0, top=10):
+        """Build the memory stats of the segment, under the caller's lock.
+
+        :param payload_bytes: Bytes holding the entries themselves.
+        :param entries: Number of entries.
+        :param entry_sizes: Iterable of (key, size in bytes) of every entry.
+        :param garbage: Bytes in use but held by nothing live.
+        :param top: Number of the largest entries to list.
+        :rtype: :class:`MemoryStats`
+        """
+        segment_size = len(self.map_file)
+        used = self._used_bytes()
+        slack = segment_size - used
+        return MemoryStats(
+            segment_size,
+            used,
+            slack,
+            garbage,
+            float(slack + garbage) / segment_size if segment_size else 0.0,
+            payload_bytes,
+            entries,
+            heapq.nlargest(top, entry_sizes, key=itemgetter(1)),
+        )
+
+    def close(self):
+        """Detach this handle from the shared memory segment.
+
+        Decrements the attach count kept in the segment header and, when
+        this was the last attached handle, unlinks the segment and the
+        semaphore. Read only handles never unlink. Closing twice is a
+        no-op.
+
+        A handle inherited across a fork was counted by its parent, the
+        child only closes its copies of the mapping and descriptors.
+        """
+        if self._closed is True:
+            return
+
+        while self._holds_lock():
+            self._release_lock()
+        if self._inherited():
+            self._close_handles()
+            return
+        last_handle = False
+        if self._map_file is not None:
+            with self._semaphore_held():
+                attach_count = max(self._read_header().attach_count - 1, 0)
+                self._write_attach_count(attach_count)
+                last_handle = attach_count == 0 and self.readonly is not True
+                if last_handle is True:
+                    try:
+                        self._shared_mem.unlink()
+                    except posix_ipc.ExistentialError:
+                        # Another handle destroyed it meanwhile
+                        pass
+                    self._unlink_semaphore()
+        elif self._semaphore is not None and self.readonly is not True:
+            # Never attached, don't leave behind a semaphore guarding nothing
+            with self._semaphore_held():
+                try:
+                    posix_ipc.SharedMemory(self.safe_shm_name).close_fd()
+                except posix_ipc.ExistentialError:
+                    last_handle = True
+                    self._unlink_semaphore()
+        self._close_handles(unlink=last_handle)
+
+    def _unlink_semaphore(self):
+        """Unlink the semaphore, while holding it, along with the segment.
+
+        Unlinking both before handing the semaphore back means a handle
+        getting it afterwards finds the segment gone, see :meth:`_attach`.
+        """
+        try:
+            self.semaphore.unlink()
+        except posix_ipc.ExistentialError:
+            # Another handle that never attached already removed it
+            pass
+
+    def destroy(self):
+        """Unlink the segment and semaphore even if other handles are attached.
+
+        Peers keep their existing mappings but new handles will start
+        from an empty segment.
+        """
+        self._check_writable()
+        while self._holds_lock():
+            self._release_lock()
+        for unlink, name in (
+            (posix_ipc.unlink_shared_memory, self.safe_shm_name),
+            (posix_ipc.unlink_semaphore, self.safe_sem_name),
+        ):
+            try:
+                unlink(name)
+            except posix_ipc.ExistentialError:
+                pass
+        self._close_handles(unlink=True)
+
+    def _close_handles(self, unlink=False):
+        """Close this process' mapping, fd and semaphore handle.
+
+        :param unlink: True if the segment and semaphore were unlinked,
+                       subclasses unlink any IPC objects of their own.
+        :type unlink: :class:`bool`
+        """
+        if self._map_file is not None:
+            self._map_file.close()
+            self._map_file = None
+        if self._shared_mem is not None:
+            self._shared_mem.close_fd()
+            self._shared_mem = None
+        if self._semaphore is not None:
+            self._semaphore.close()
+            self._semaphore = None
+        self._closed = True
+
+    def __enter__(self):
+        """Return self so the segment can be closed by a with statement."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the segment on leaving the with statement."""
+        self.close()
+
+    def __del__(self):
+        """Close the object nicely if it was never closed explicitly."""
+        if getattr(self, "_closed", True) is False:
+            self.close()
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+from collections import namedtuple
+import random
+import struct
+
+# Related third party imports (If you used pip/apt/yum to install)
+import six
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from ._version import __version__
+from .hashing import SEGMENT_HASHER, KeyHasher, check_hasher
+from .segment import SUBHEADER_OFFSET, SHMSegment
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle-shm_dict@natrinicle.com"
+__status__ = "Production"
+
+# After the common segment header come the table size, the live entry
+# count, the number of non empty slots (live plus deleted), where the next
+# record goes in the heap, how many heap bytes are held by replaced or
+# deleted records and the seed and name of the key hasher. The open
+# addressing table starts at TABLE_OFFSET and is followed by the heap of
+# length prefixed key/value records.
+TABLE_OFFSET = 128
+MIN_SLOTS = 8
+
+_TABLE_HEADER = struct.Struct("<QQQQQQ16s")
+_TableHeader = namedtuple(
+    "_TableHeader",
+    ["slots", "count", "used", "heap_end", "garbage", "hash_seed", "hasher"],
+)
+_SLOT = struct.Struct("<QQ")
+_RECORD = struct.Struct("<II")
+
+# Slot record offsets, anything else is the offset of a live record
+_EMPTY = 0
+_DELETED = 1
+
+
+class SHMBytesDict(SHMSegment, MutableMapping):
+    """Shared memory dictionary of str/bytes keys to str/bytes values.
+
+    Entries are stored as raw length prefixed records in the segment and
+    located through an open addressing hash table, so a lookup is a hash,
+    a probe and a slice without pickling the rest of the dictionary.
+    """
+
+    segment_magic = b"SHMB"
+    segment_layout = 2
+
+    def __init__(
+        self,
+        name,
+        key_type=six.text_type,
+        value_type=bytes,
+        lock_timeout=30,
+        auto_unlock=False,
+        readonly=False,
+        preallocate=None,
+        populate=False,
+        huge_pages=False,
+        access=None,
+        hash_seed=None,
+        hasher=SEGMENT_HASHER,
+    ):
+        """Standard init method.
+
+        :param name: Name for shared memory and semaphore.
+        :param key_type: Type keys are returned as, str keys are stored
+                         UTF-8 encoded.
+        :param value_type: Type values are returned as, str values are
+                           stored UTF-8 encoded.
+        :param lock_timeout: Time in seconds before giving up on
+                             acquiring an exclusive lock to the
+                             dictionary.
+        :param auto_unlock: If the lock_timeout is hit, and this
+                            is True, automatically bypass the
+                            lock and use the dictionary anyway.
+        :param readonly: Attach to an already existing shared memory
+                         segment without ever creating, resizing,
+                         writing into or unlinking it.
+        :param preallocate: Grow the shared memory segment to at least
+                            this many bytes up front so it isn't
+                            remapped as the dictionary grows.
+        :param populate: Pre-fault the segment's pages, and any it grows
+                         into, instead of faulting them in on first use.
+        :param huge_pages: Ask for transparent huge pages to back the
+                           segment, where the kernel allows it for
+                           shared memory.
+        :param access: Expected access pattern, "sequential" or
+                       "random", passed on to the kernel as a hint.
+        :param hash_seed: 64 bit seed for hashing keys, random if None.
+                          Only used by the handle creating the segment,
+                          every other one reads it from the segment.
+        :param hasher: Name of the key hasher, see
+                       :mod:`shm_dict.hashing`, xxh64 if the xxhash
+                       extra is installed and sha256 otherwise. Only
+                       used by the handle creating the segment too.
+        :type name: :class:`str`
+        :type key_type: :class:`type`, str or bytes
+        :type value_type: :class:`type`, str or bytes
+        :type lock_timeout: :class:`int` or :class:`float`
+        :type auto_unlock: :class:`bool`
+        :type readonly: :class:`bool`
+        :type preallocate: :class:`int` or None
+        :type populate: :class:`bool`
+        :type huge_pages: :class:`bool`
+        :type access: :class:`str` or None
+        :type hash_seed: :class:`int` or None
+        :type hasher: :class:`str`
+        """
+        check_hasher(hasher)
+        for kind, data_type in (("key_type", key_type), ("value_type", value_type)):
+            if data_type not in (six.text_type, bytes):
+                raise TypeError("{} must be str or bytes".format(kind))
+        self.key_type = key_type
+        self.value_type = value_type
+        self.hash_seed = hash_seed
+        self.hasher = hasher
+        self.__key_hasher = None
+
+        super(SHMBytesDict, self).__init__(
+            name,
+            lock_timeout=lock_timeout,
+            auto_unlock=auto_unlock,
+            readonly=readonly,
+            preallocate=preallocate,
+            populate=populate,
+            huge_pages=huge_pages,
+            access=access,
+        )
+
+    @staticmethod
+    def __encode(data, kind):
+        """Encode a key or value to the bytes stored in the segment."""
+        if isinstance(data, bytes):
+            return data
+        if isinstance(data, six.text_type):
+            return data.encode("utf-8")
+        raise TypeError(
+            "SHMBytesDict {}s must be str or bytes, not {}".format(
+                kind, type(data).__name__
+            )
+        )
+
+    @staticmethod
+    def __decode(data, data_type):
+        """Decode bytes read from the segment to the configured type."""
+        if data_type is bytes:
+            return data
+        return data.decode("utf-8")
+
+    def _initialize_segment(self):
+        """Lay out an empty table in a freshly created segment."""
+        hash_seed = self.hash_seed
+        if hash_seed is None:
+            hash_seed = random.SystemRandom().getrandbits(64)
+        self.__reset(key_hasher=KeyHasher(hash_seed, self.hasher))
+        super(SHMBytesDict, self)._initialize_segment()
+
+    def __reset(self, slots=MIN_SLOTS, key_hasher=None):
+        """Empty the table, resizing the segment to fit slots."""
+        if key_hasher is None:
+            key_hasher = self.__get_key_hasher()
+        heap_start = TABLE_OFFSET + slots * _SLOT.size
+        map_file = self._resize(heap_start)
+        map_file[TABLE_OFFSET:heap_start] = b"\x00" * (heap_start - TABLE_OFFSET)
+        self.__write_table_header(
+            _TableHeader(
+                slots,
+                0,
+                0,
+                heap_start,
+                0,
+                key_hasher.seed,
+                key_hasher.hasher.encode("ascii"),
+            )
+        )
+
+    def __get_key_hasher(self):
+        """Return the key hasher the segment was created with."""
+        if self.__key_hasher is None:
+            header = self.__read_table_header()
+            self.__key_hasher = KeyHasher(
+                header.hash_seed, header.hasher.rstrip(b"\x00").decode("ascii")
+            )
+        return self.__key_hasher
+
+    @property
+    def key_hasher(self):
+        """The :class:`shm_dict.hashing.KeyHasher` every handle hashes keys with.
+
+        Its seed is stored in the segment, so anything laying out or
+        sharding keys by it agrees with every other process.
+        """
+        with self.exclusive_lock():
+            return self.__get_key_hasher()
+
+    def __read_table_header(self):
+        """Read the table header."""
+        return _TableHeader(*_TABLE_HEADER.unpack_from(self.map_file, SUBHEADER_OFFSET))
+
+    def __write_table_header(self, header):
+        """Write the table header."""
+        _TABLE_HEADER.pack_into(self.map_file, SUBHEADER_OFFSET, *header)
+
+    def _used_bytes(self):
+        """Bytes used by the headers, the table and the record heap."""
+        return self.__read_table_header().heap_end
+
+    def memory_stats(self, top=10):
+        """Report how the segment's memory is used.
+
+        Garbage is the heap held by replaced and deleted records until
+        the next rebuild, slack the part of the segment past the heap.
+
+        :param top: Number of the largest entries to list.
+        :type top: :class:`int`
+        :rtype: :class:`shm_dict.segment.MemoryStats` whose largest_keys
+                are (key, bytes) of the largest records.
+        """
+        with self.exclusive_lock():
+            map_file = self.map_file
+            header = self.__read_table_header()
+            heap_start = TABLE_OFFSET + header.slots * _SLOT.size
+            return self._memory_stats(
+                header.heap_end - heap_start - header.garbage,
+                header.count,
+                (
+                    (
+                        self.__read_key(map_file, record),
+                        self.__record_size(map_file, record),
+                    )
+                    for _, record in self.__records()
+                ),
+                garbage=header.garbage,
+                top=top,
+            )
+
+    def __find(self, map_file, slots, key, key_hash):
+        """Probe the table for an encoded key.
+
+        :return: (slot, record offset) of key if found, otherwise the
+                 slot to insert key into and a record offset of 0.
+        """
+        mask = slots - 1
+        slot = key_hash & mask
+        insert_slot = None
+        while True:
+            slot_hash, record = _SLOT.unpack_from(
+                map_file, TABLE_OFFSET + slot * _SLOT.size
+            )
+            if record == _EMPTY:
+                return (slot if insert_slot is None else insert_slot), 0
+            if record == _DELETED:
+                if insert_slot is None:
+                    insert_slot = slot
+            elif slot_hash == key_hash:
+                key_len = _RECORD.unpack_from(map_file, record)[0]
+                key_start = record + _RECORD.size
+                if map_file[key_start : key_start + key_len] == key:
+                    return slot, record
+            slot = (slot + 1) & mask
+
+    @staticmethod
+    def __record_size(map_file, record):
+        """Total size in bytes of the record at offset record."""
+        key_len, value_len = _RECORD.unpack_from(map_file, record)
+        return _RECORD.size + key_len + value_len
+
+    def __records(self):
+        """Yield (slot hash, record offset) of every live entry."""
+        map_file = self.map_file
+        slots = self.__read_table_header().slots
+        for slot in range(slots):
+            slot_hash, record = _SLOT.unpack_from(
+                map_file, TABLE_OFFSET + slot * _SLOT.size
+            )
+            if record > _DELETED:
+                yield slot_hash, record
+
+    def __read_key(self, map_file, record):
+        """Return the decoded key of the record at offset record."""
+        key_start = record + _RECORD.size
+        key_len = _RECORD.unpack_from(map_file, record)[0]
+        return self.__decode(map_file[key_start : key_start + key_len], self.key_type)
+
+    def __read_record(self, map_file, record):
+        """Return the decoded (key, value) of the record at offset record."""
+        key_len, value_len = _RECORD.unpack_from(map_file, record)
+        key_start = record + _RECORD.size
+        value_start = key_start + key_len
+        return (
+            self.__decode(map_file[key_start:value_start], self.key_type),
+            self.__decode(
+                map_file[value_start : value_start + value_len], self.value_type
+            ),
+        )
+
+    def __rebuild(self, extra):
+        """Rebuild the table and heap with room for extra record bytes.
+
+        Drops deleted slots and replaced records and doubles the table
+        and heap past what the live entries need, so rebuilding is
+        amortized over many inserts.
+        """
+        map_file = self.map_file
+        live = [
+            (
+                slot_hash,
+                map_file[record : record + self.__record_size(map_file, record)],
+            )
+            for slot_hash, record in self.__records()
+        ]
+
+        slots = MIN_SLOTS
+        while slots < (len(live) + 1) * 2:
+            slots *= 2
+        heap_start = TABLE_OFFSET + slots * _SLOT.size
+        heap_len = sum(len(record) for _, record in live)
+
+        table = bytearray(slots * _SLOT.size)
+        heap = bytearray()
+        mask = slots - 1
+        for slot_hash, record in live:
+            slot = slot_hash & mask
+            while _SLOT.unpack_from(table, slot * _SLOT.size)[1] != _EMPTY:
+                slot = (slot + 1) & mask
+            _SLOT.pack_into(table, slot * _SLOT.size, slot_hash, heap_start + len(heap))
+            heap += record
+
+        map_file = self._resize(heap_start + (heap_len + extra) * 2)
+        map_file[TABLE_OFFSET:heap_start] = bytes(table)
+        map_file[heap_start : heap_start + heap_len] = bytes(heap)
+        self.__write_table_header(
+            self.__read_table_header()._replace(
+                slots=slots,
+                count=len(live),
+                used=len(live),
+                heap_end=heap_start + heap_len,
+                garbage=0,
+            )
+        )
+
+    def __setitem__(self, key, value):
+        """Set a key in the dictionary to a value."""
+        self._check_writable()
+        key = self.__encode(key, "key")
+        value = self.__encode(value, "value")
+        key_hash = self.__get_key_hasher().hash_bytes(key)
+        record_size = _RECORD.size + len(key) + len(value)
+
+        with self.exclusive_lock():
+            header = self.__read_table_header()
+            table_full = (header.used + 1) * 4 > header.slots * 3
+            heap_full = header.heap_end + record_size > len(self.map_file)
+            if table_full or heap_full:
+                self.__rebuild(record_size)
+                header = self.__read_table_header()
+
+            map_file = self.map_file
+            slot, old_record = self.__find(map_file, header.slots, key, key_hash)
+            slot_offset = TABLE_OFFSET + slot * _SLOT.size
+            if old_record != _EMPTY:
+                header = header._replace(
+                    garbage=header.garbage + self.__record_size(map_file, old_record)
+                )
+            else:
+                if _SLOT.unpack_from(map_file, slot_offset)[1] == _EMPTY:
+                    header = header._replace(used=header.used + 1)
+                header = header._replace(count=header.count + 1)
+
+            record = header.heap_end
+            _RECORD.pack_into(map_file, record, len(key), len(value))
+            key_start = record + _RECORD.size
+            map_file[key_start : key_start + len(key)] = key
+            map_file[key_start + len(key) : record + record_size] = value
+            _SLOT.pack_into(map_file, slot_offset, key_hash, record)
+            self.__write_table_header(header._replace(heap_end=record + record_size))
+
+    def __getitem__(self, key):
+        """Get the value of a key from the dictionary."""
+        encoded = self.__encode(key, "key")
+        key_hash = self.__get_key_hasher().hash_bytes(encoded)
+        with self.exclusive_lock():
+            map_file = self.map_file
+            slots = self.__read_table_header().slots
+            record = 0
+            if slots > 0:
+                record = self.__find(map_file, slots, encoded, key_hash)[1]
+            if record == _EMPTY:
+                raise KeyError(key)
+            return self.__read_record(map_file, record)[1]
+
+    def __delitem__(self, key):
+        """Remove an item from the dictionary."""
+        self._check_writable()
+        encoded = self.__encode(key, "key")
+        key_hash = self.__get_key_hasher().hash_bytes(encoded)
+        with self.exclusive_lock():
+            map_file = self.map_file
+            header = self.__read_table_header()
+            slot, record = self.__find(map_file, header.slots, encoded, key_hash)
+            if record == _EMPTY:
+                raise KeyError(key)
+            _SLOT.pack_into(map_file, TABLE_OFFSET + slot * _SLOT.size, 0, _DELETED)
+            self.__write_table_header(
+                header._replace(
+                    count=header.count - 1,
+                    garbage=header.garbage + self.__record_size(map_file, record),
+                )
+            )
+
+    def __contains__(self, key):
+        """Check if a key exists inside the dictionary."""
+        try:
+            self[key]
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __len__(self):
+        """Return the length of the dictionary."""
+        with self.exclusive_lock():
+            return self.__read_table_header().count
+
+    def __iter__(self):
+        """Iterate through a snapshot of the dictionary keys."""
+        with self.exclusive_lock():
+            map_file = self.map_file
+            return iter(
+                [self.__read_key(map_file, record) for _, record in self.__records()]
+            )
+
+    def __repr__(self):
+        """Represent the dictionary in a human readable format."""
+        return repr(self.copy())
+
+    def __eq__(self, other):
+        """Shared memory dictionary equality check with another one."""
+        return (
+            isinstance(other, SHMBytesDict)
+            and self.safe_shm_name == other.safe_shm_name
+        )
+
+    def __ne__(self, other):
+        """Shared memory dictionary non-equality check with another one."""
+        return not self == other
+
+    def clear(self):
+        """Completely clear the dictionary."""
+        self._check_writable()
+        with self.exclusive_lock():
+            self.__reset()
+
+    def copy(self):
+        """Return every entry as a regular dictionary under one lock."""
+        with self.exclusive_lock():
+            map_file = self.map_file
+            return dict(
+                self.__read_record(map_file, record) for _, record in self.__records()
+            )
+
+    def has_key(self, key):
+        """Return true if a key is in the dictionary."""
+        return key in self
@@ -2,22 +2,23 @@
 # -*- coding: utf-8 -*-
 
 # Standard library imports
-import base64
+import atexit
 
 try:
     from collections.abc import MutableMapping
 except ImportError:
     from collections import MutableMapping
 
-from contextlib import contextmanager
-import hashlib
+from collections import namedtuple
 import logging
-from math import ceil
-import mmap
+import multiprocessing
 import os
 import pickle  # nosec
+import struct
 import sys
 import threading
+import time
+import weakref
 
 # Related third party imports (If you used pip/apt/yum to install)
 import posix_ipc
@@ -25,6 +26,22 @@ import six
 
 # Local application/library specific imports (Look ma! I wrote it myself!)
 from ._version import __version__
+from .compression import (
+    DEFAULT_THRESHOLD,
+    check_codec,
+    compress_value,
+    decompress_value,
+)
+from .indexes import Indexes, keys_in_range, keys_with_prefix
+from .persist import (
+    DEFAULT_CHUNK_SIZE,
+    LazyDict,
+    dump_indexed,
+    dump_stream,
+    load_persist_file,
+    load_stream,
+)
+from .segment import SUBHEADER_OFFSET, SHMSegment
 
 __author__ = "Nate Bohman"
 __credits__ = ["Nate Bohman"]
@@ -35,11 +52,187 @@ __status__ = "Production"
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+# After the common segment header come the lengths of the pickled
+# dictionary, which itself starts at PAYLOAD_OFFSET, of the pickled
+# indexes and of the pickled entry versions that follow it, then the
+# generation. The generation is odd while a save is under way and moves
+# on with every save, so readers can copy the payload without the
+# semaphore and check nobody wrote to it meanwhile. The header is padded
+# out so fields can be added without moving the payload.
+PAYLOAD_OFFSET = 64
 
-class SHMDict(MutableMapping):
+_PAYLOAD_HEADER = struct.Struct("<QQQQ")
+_PayloadHeader = namedtuple(
+    "_PayloadHeader", ["payload_len", "index_len", "versions_len", "generation"]
+)
+_Payload = namedtuple("_Payload", ["payload", "indexes", "versions", "generation"])
+
+# Times a read only handle retries copying the payload while saves keep
+# getting in the way before it waits for the semaphore instead.
+_LOCK_FREE_RETRIES = 8
+
+try:
+    _monotonic_ns = time.monotonic_ns
+except AttributeError:
+
+    def _monotonic_ns():
+        """Nanosecond timestamp for interpreters without time.monotonic_ns."""
+        return int(time.time() * 1e9)
+
+
+# A protocol 2 pickle of a dictionary pushes an empty dictionary, puts
+# it in the memo, adds the items to it a batch at a time and stops, so
+# the items of dictionaries pickled separately can be spliced into one.
+# Each part only refers back to memo entries it put itself.
+_DICT_PICKLE_HEAD = pickle.dumps({}, 2)[:-1]
+
+# Entries, version, compression and compress_threshold of the bulk load
+# a pool worker was started for.
+_bulk_job = None
+
+# Handles with keys buffered by write_behind or flush_interval, by id
+_buffering_handles = weakref.WeakValueDictionary()
+
+# Types whose values can't be changed in place, so are never copied
+_IMMUTABLE_TYPES = frozenset(
+    (type(None), bool, float, complex, bytes, six.text_type) + six.integer_types
+)
+
+
+def _flush_at_exit():
+    """Publish the keys handles still have buffered as the interpreter exits."""
+    for handle in list(_buffering_handles.values()):
+        try:
+            handle.flush()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Lost the keys buffered by %s", handle.name)
+
+
+atexit.register(_flush_at_exit)
+
+
+def _private_copy(value):
+    """Return a copy of value sharing no mutable state with it.
+
+    Handles keep their dictionary between locks, so values going in or
+    out of it are copied for changes made to them in place not to reach
+    the dictionary, and from there every handle once anything is saved.
+    """
+    if type(value) in _IMMUTABLE_TYPES:
+        return value
+    return pickle.loads(pickle.dumps(value, 2))  # nosec
+
+
+def _read_value(stored):
+    """Return the value of a stored value as a copy the caller may change."""
+    value = decompress_value(stored)
+    if value is stored:
+        return _private_copy(value)
+    # Compressed values are unpickled afresh on every read
+    return value
+
+
+def _strip_dict_pickle(data):
+    """Return the items of a protocol 2 dictionary pickle."""
+    return data[len(_DICT_PICKLE_HEAD) : -len(pickle.STOP)]
+
+
+def _pickle_items(bounds, entries, version, compression, compress_threshold):
+    """Pickle the (start, stop) slice of entries and their versions.
+
+    :return: (pickled items, pickled versions), both without the head
+             or STOP opcode of a dictionary pickle.
+    """
+    chunk = {}
+    for key, value in entries[bounds[0] : bounds[1]]:
+        if compression is not None:
+            value = compress_value(value, compression, compress_threshold)
+        chunk[key] = value
+    return (
+        _strip_dict_pickle(pickle.dumps(chunk, 2)),
+        _strip_dict_pickle(pickle.dumps(dict.fromkeys(chunk, version), 2)),
+    )
+
+
+def _start_bulk_worker(*bulk_job):
+    """Pool initializer keeping the entries to pickle.
+
+    Forked workers inherit entries rather than having them pickled over.
+    """
+    global _bulk_job  # pylint: disable=global-statement
+    _bulk_job = bulk_job
+
+
+def _pickle_bulk_chunk(bounds):
+    """Pool task pickling a slice of the worker's entries."""
+    return _pickle_items(bounds, *_bulk_job)
+
+
+def _pickle_dict_parts(entries, workers, version, compression, compress_threshold):
+    """Pickle (key, value) pairs, and their versions, as dictionaries in parts.
+
+    :param entries: List of (key, value) pairs, later keys win.
+    :param workers: Number of processes to pickle in, the CPU count if
+                    None, in this process if 1 or fewer.
+    :param version: Version to give every key.
+    :return: (payload parts, versions parts), lists of byte strings that
+             joined are the dictionary and the versions pickles.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    # A few chunks per worker keeps them all busy to the end
+    chunk_size = max(-(-len(entries) // (max(workers, 1) * 4)), 1)
+    bounds = [
+        (start, start + chunk_size) for start in range(0, len(entries), chunk_size)
+    ]
+    bulk_job = (entries, version, compression, compress_threshold)
+
+    if workers <= 1 or len(bounds) <= 1:
+        parts = [_pickle_items(chunk_bounds, *bulk_job) for chunk_bounds in bounds]
+    else:
+        pool = multiprocessing.Pool(
+            min(workers, len(bounds)), _start_bulk_worker, bulk_job
+        )
+        try:
+            parts = pool.map(_pickle_bulk_chunk, bounds)
+        finally:
+            pool.close()
+            pool.join()
+
+    payload_parts = [_DICT_PICKLE_HEAD]
+    versions_parts = [_DICT_PICKLE_HEAD]
+    for items, versions in parts:
+        payload_parts.append(items)
+        versions_parts.append(versions)
+    payload_parts.append(pickle.STOP)
+    versions_parts.append(pickle.STOP)
+    return payload_parts, versions_parts
+
+
+class SHMDict(SHMSegment, MutableMapping):
     """Python shared memory dictionary."""
 
-    def __init__(self, name, persist=False, lock_timeout=30, auto_unlock=False):
+    segment_magic = b"SHMD"
+    segment_layout = 2
+
+    def __init__(
+        self,
+        name,
+        persist=False,
+        lock_timeout=30,
+        auto_unlock=False,
+        readonly=False,
+        warm_up=True,
+        compression=None,
+        compress_threshold=DEFAULT_THRESHOLD,
+        ordered=False,
+        preallocate=None,
+        populate=False,
+        huge_pages=False,
+        access=None,
+        write_behind=None,
+        flush_interval=None,
+    ):
         """Standard init method.
 
         :param name: Name for shared memory and semaphore if volatile
@@ -54,210 +247,601 @@ class SHMDict(MutableMapping):
         :param auto_unlock: If the lock_timeout is hit, and this
                             is True, automatically bypass the
                             lock and use the dictionary anyway.
+        :param readonly: Attach to an already existing shared memory
+                         segment without ever creating, resizing,
+                         serializing into or unlinking it. Raises
+                         :class:`posix_ipc.ExistentialError` if the
+                         segment does not exist yet.
+        :param warm_up: When the segment is empty and the persist
+                        file is opened lazily, publish the whole file
+                        into the segment from a background thread so
+                        later lookups don't touch the disk.
+        :param compression: Codec (zlib, lz4 or zstd) used to compress
+                            values written through this handle, in the
+                            segment and the persist file. Compressed
+                            values are read back by any handle.
+        :param compress_threshold: Values whose pickle is smaller than
+                                   this many bytes are stored
+                                   uncompressed.
+        :param ordered: Keep a sorted array of the keys in shared
+                        memory to speed up :meth:`keys_with_prefix`,
+                        :meth:`range` and :meth:`items_range`. It is
+                        built on the first write through this handle,
+                        from then on every handle maintains it. Keys
+                        must be mutually orderable.
+        :param preallocate: Grow the shared memory segment to at least
+                            this many bytes up front so it isn't
+                            remapped as the dictionary grows.
+        :param populate: Pre-fault the segment's pages, and any it grows
+                         into, instead of faulting them in on first use.
+        :param huge_pages: Ask for transparent huge pages to back the
+                           segment, where the kernel allows it for
+                           shared memory.
+        :param access: Expected access pattern, "sequential" or
+                       "random", passed on to the kernel as a hint.
+        :param write_behind: Buffer keys set through this handle and
+                             publish them together once this many are
+                             waiting, see :meth:`flush`.
+        :param flush_interval: Buffer keys set through this handle and
+                               publish them at most this many seconds
+                               after the first one was buffered.
         :type name: :class:`str`
         :type persist: :class:`bool`
         :type lock_timeout: :class:`int` or :class:`float`
         :type auto_unlock: :class:`bool`
+        :type readonly: :class:`bool`
+        :type warm_up: :class:`bool`
+        :type compression: :class:`str` or None
+        :type compress_threshold: :class:`int`
+        :type ordered: :class:`bool`
+        :type preallocate: :class:`int` or None
+        :type populate: :class:`bool`
+        :type huge_pages: :class:`bool`
+        :type access: :class:`str` or None
+        :type write_behind: :class:`int` or None
+        :type flush_interval: :class:`int` or :class:`float` or None
         """
-        self.name = name
         self.persist_file = None
-        self.lock_timeout = lock_timeout
-        self.auto_unlock = auto_unlock
-        self._semaphore = None
-        self._map_file = None
-        self.__thread_local = threading.local()
-        self.__thread_local.semaphore = False
+        self.warm_up = warm_up
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.ordered = ordered
         self.__internal_dict = None
+        # Pickled indexes as loaded, only unpickled once they are needed
+        self.__index_data = b""
+        self.__indexes = None
+        self.__versions = {}
         self.__dirty = False
+        self.__generation = None
+        self._warm_up_thread = None
+        self.__warm_up_pending = False
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.__buffer = {}
+        # Buffered keys stored under the current lock but not yet saved
+        self.__applied = {}
+        self.__buffer_lock = threading.Lock()
+        self.__flush_timer = None
+
+        if self.compression is not None:
+            check_codec(self.compression)
 
         if persist is True:
-            self.persist_file = self.name
+            self.persist_file = name
             if self.persist_file.startswith("~"):
                 self.persist_file = os.path.expanduser(self.persist_file)
             self.persist_file = os.path.abspath(os.path.realpath(self.persist_file))
 
-        super(SHMDict, self).__init__()
+        super(SHMDict, self).__init__(
+            name,
+            lock_timeout=lock_timeout,
+            auto_unlock=auto_unlock,
+            readonly=readonly,
+            preallocate=preallocate,
+            populate=populate,
+            huge_pages=huge_pages,
+            access=access,
+        )
 
-    def _safe_name(self, prefix=""):
-        """IPC object safe name creator.
+    def __read_payload_header(self):
+        """Read the payload header."""
+        return _PayloadHeader(
+            *_PAYLOAD_HEADER.unpack_from(self.map_file, SUBHEADER_OFFSET)
+        )
 
-        Semaphores and Shared Mmeory names allow up to 256 characters (dependong on OS) and must
-        begin with a /.
+    def __read_payload(self):
+        """Copy the pickled dictionary, indexes and versions out of the segment."""
+        header = self.__read_payload_header()
+        map_file = self.map_file
+        index_offset = PAYLOAD_OFFSET + header.payload_len
+        versions_offset = index_offset + header.index_len
+        return _Payload(
+            map_file[PAYLOAD_OFFSET:index_offset],
+            map_file[index_offset:versions_offset],
+            map_file[versions_offset : versions_offset + header.versions_len],
+            header.generation,
+        )
 
-        :param prefix: A string to prepend followed by _ and
-                       then the dictionary's name.
-        :type prefix: :class:`str`
-        """
-        # Hash lengths
-        # SHA1: 28
-        # SHA256: 44
-        # SHA512: 88
-        sha_hash = hashlib.sha512()
-        sha_hash.update("_".join([prefix, str(self.name)]).encode("utf-8"))
-        b64_encode = base64.urlsafe_b64encode(sha_hash.digest())
-        return "/{}".format(b64_encode)
-
-    @property
-    def safe_sem_name(self):
-        """Unique semaphore name based on the dictionary name."""
-        return self._safe_name("sem")
-
-    @property
-    def safe_shm_name(self):
-        """Unique shared memory segment name based on the dictionary name."""
-        return self._safe_name("shm")
-
-    @property
-    def semaphore(self):
-        """Create or return already existing semaphore."""
-        if self._semaphore is not None:
-            return self._semaphore
+    def __read_payload_lock_free(self):
+        """Copy the payload without the semaphore, None if saves kept interfering.
 
-        try:
-            self._semaphore = posix_ipc.Semaphore(self.safe_sem_name)
-        except posix_ipc.ExistentialError:
-            self._semaphore = posix_ipc.Semaphore(
-                self.safe_sem_name, flags=posix_ipc.O_CREAT, initial_value=1
-            )
-        return self._semaphore
+        Relies on a save making the generation odd before touching the
+        payload and moving it on again once done, and on segments only
+        ever growing so this handle's mapping stays valid meanwhile.
+        """
+        for _ in range(_LOCK_FREE_RETRIES):
+            generation = self.__read_payload_header().generation
+            if generation % 2 == 0:
+                payload = self.__read_payload()
+                if self.__read_payload_header().generation == generation:
+                    return payload
+            time.sleep(0)
+        return None
 
-    @property
-    def shared_mem(self):
-        """Create or return already existing shared memory object."""
-        try:
-            return posix_ipc.SharedMemory(
-                self.safe_shm_name, size=len(pickle.dumps(self.__internal_dict))
-            )
-        except posix_ipc.ExistentialError:
-            return posix_ipc.SharedMemory(
-                self.safe_shm_name, flags=posix_ipc.O_CREX, size=posix_ipc.PAGE_SIZE
-            )
+    def __load_dict(self, payload=None):
+        """Load dictionary from shared memory or file if persistent and memory empty.
 
-    @property
-    def map_file(self):
-        """Create or return mmap file resizing if necessary."""
-        if self._map_file is None:
-            self._map_file = mmap.mmap(self.shared_mem.fd, self.shared_mem.size)
-            self.shared_mem.close_fd()
-
-        self._map_file.resize(
-            int(
-                ceil(float(len(pickle.dumps(self.__internal_dict, 2))) / mmap.PAGESIZE)
-                * mmap.PAGESIZE
-            )
-        )
-        return self._map_file
-
-    def __load_dict(self):
-        """Load dictionary from shared memory or file if persistent and memory empty."""
+        :param payload: Payload already copied out of the segment, read
+                        from the segment if None.
+        :type payload: :class:`_Payload`
+        """
         # Read in internal data from map_file
-        self.map_file.seek(0)
-        try:
-            self.__internal_dict = pickle.load(self.map_file)  # nosec
-        except (KeyError, pickle.UnpicklingError, EOFError):
-            # Curtis Pullen found that Python 3.4 throws EOFError
-            # instead of UnpicklingError that Python 3.6 throws
-            # when attempting to unpickle an empty file.
-            pass
+        if payload is None:
+            payload = self.__read_payload()
+        if payload.payload:
+            self.__internal_dict = pickle.loads(payload.payload)  # nosec
+        elif not isinstance(self.__internal_dict, LazyDict):
+            # Nobody has published to the segment since the persist
+            # file was opened lazily, so keep reading from that.
+            self.__internal_dict = None
 
         # If map_file is empty and persist_file is true, treat
         # self.name as filename and attempt to load from disk.
         if self.__internal_dict is None and self.persist_file is not None:
             try:
-                with open(self.persist_file, "rb") as pfile:
-                    self.__internal_dict = pickle.load(pfile)  # nosec
+                self.__internal_dict = load_persist_file(self.persist_file)
             except IOError:
                 pass
+            else:
+                # Warmed up once the semaphore is handed back
+                self.__warm_up_pending = isinstance(self.__internal_dict, LazyDict)
 
         # If map_file is empty, persist_file is False or
         # self.name is empty create a new empty dictionary.
         if self.__internal_dict is None:
             self.__internal_dict = {}
 
-    def __save_dict(self):
-        """Save dictionary into shared memory and file if persistent."""
+        self.__index_data = payload.indexes
+        self.__indexes = None
+
+        if payload.versions:
+            self.__versions = pickle.loads(payload.versions)  # nosec
+        else:
+            self.__versions = {}
+        self.__generation = payload.generation
+
+    def __get_indexes(self):
+        """Return the indexes, unpickled the first time they are needed."""
+        if self.__indexes is None:
+            if self.__index_data:
+                self.__indexes = pickle.loads(self.__index_data)  # nosec
+            else:
+                self.__indexes = Indexes()
+        return self.__indexes
+
+    def __indexes_to_maintain(self):
+        """Return the indexes a write must keep up to date, None if there are none.
+
+        Secondary indexes pickle their key_func, so they are only
+        unpickled when something is written or queried and handles that
+        only read never need key_func's module. The ordered index is
+        likewise only built on the first write, so reading a lazily
+        opened persist file doesn't sort its keys and rewrite it.
+        """
+        if self.ordered is True:
+            indexes = self.__get_indexes()
+            if indexes.keys is None:
+                indexes.enable_ordered(self.__internal_dict)
+            return indexes
+        if self.__indexes is None and not self.__index_data:
+            return None
+        return self.__get_indexes() or None
+
+    def __start_warm_up(self):
+        """Start publishing a lazily opened persist file in the background."""
+        if self.readonly is True or self.warm_up is not True:
+            return
+        if self._warm_up_thread is not None and self._warm_up_thread.is_alive():
+            return
+
+        self._warm_up_thread = threading.Thread(
+            target=self.__warm_up, name="SHMDict warm up {}".format(self.name)
+        )
+        self._warm_up_thread.start()
+
+    def __warm_up(self):
+        """Load the whole persist file and publish it into the segment.
+
+        Reading and pickling every value takes as long as the file is
+        big, so it is done without the semaphore, which is only taken to
+        publish and only if nobody published meanwhile. Runs on its own
+        handle so it doesn't share unlocked state with the handle that
+        started it. It isn't a daemon thread so the process can't exit
+        while it holds the semaphore.
+        """
+        try:
+            with SHMDict(
+                self.name,
+                persist=True,
+                lock_timeout=self.lock_timeout,
+                warm_up=False,
+            ) as warm_dict:
+                with warm_dict._semaphore_held():
+                    header = warm_dict.__read_payload_header()
+                if header.payload_len > 0:
+                    return
+                try:
+                    payload = pickle.dumps(load_persist_file(self.persist_file), 2)
+                except IOError:
+                    return
+                with warm_dict._semaphore_held():
+                    if warm_dict.__read_payload_header() == header:
+                        warm_dict.__publish([payload])
+        except posix_ipc.BusyError:
+            logger.debug("Gave up warming up %s, semaphore is busy", self.name)
+
+    def __save_dict(self, persist=True):
+        """Save dictionary into shared memory and file if persistent.
+
+        :param persist: Write the persist file too, if there is one.
+        :type persist: :class:`bool`
+        """
         # Write out internal dict to map_file
-        if self.__dirty is True:
-            self.map_file.seek(0)
-            pickle.dump(self.__internal_dict, self.map_file, 2)
+        if self.__dirty is True or self.__applied:
+            self.__publish([pickle.dumps(self.__internal_dict, 2)])
 
-            if self.persist_file is not None:
-                with open(self.persist_file, "wb") as pfile:
-                    pickle.dump(self.__internal_dict, pfile, 2)
+            if persist is True and self.persist_file is not None:
+                dump_indexed(self.__internal_dict, self.persist_file)
 
         self.__dirty = False
+        self.__applied = {}
 
-    def _acquire_lock(self):
-        """Acquire an exclusive dict lock.
+    def __save_changes(self, failed):
+        """Save, or if failed roll back, the changes made under the lock."""
+        if failed is True and self.__dirty is True:
+            self.__discard_changes()
+            return
+        try:
+            self.__save_dict()
+        except Exception:
+            self.__discard_changes()
+            raise
+
+    def __discard_changes(self):
+        """Drop unsaved changes so the next lock reloads what the segment holds.
+
+        Buffered keys stored under the lock are buffered again.
+        """
+        self.__dirty = False
+        self.__generation = None
+        with self.__buffer_lock:
+            applied, self.__applied = self.__applied, {}
+            if applied:
+                applied.update(self.__buffer)
+                self.__buffer = applied
+                self.__start_flush_timer()
+
+    def __publish(self, payload_parts, versions_parts=None):
+        """Write the pickled dictionary, given in parts, indexes and versions.
+
+        :param payload_parts: Byte strings that joined are the pickled
+                              dictionary, written one after the other
+                              rather than joined first.
+        :param versions_parts: Byte strings that joined are the pickled
+                               versions, pickled from this handle's if
+                               None.
+        :type payload_parts: :class:`list`
+        :type versions_parts: :class:`list` or None
+        """
+        if self.__indexes is None:
+            # Never unpickled so never changed
+            index_data = self.__index_data
+        else:
+            index_data = pickle.dumps(self.__indexes, 2) if self.__indexes else b""
+        if versions_parts is None:
+            versions_parts = (
+                [pickle.dumps(self.__versions, 2)] if self.__versions else []
+            )
+        payload_len = sum(len(part) for part in payload_parts)
+        versions_len = sum(len(part) for part in versions_parts)
+
+        # Odd generation while the payload is inconsistent, it is
+        # already odd if an earlier save failed part way through
+        header = self.__read_payload_header()
+        generation = header.generation | 1
+        self.__write_payload_header(header._replace(generation=generation))
+        self.__generation = None
+        map_file = self._resize(
+            PAYLOAD_OFFSET + payload_len + len(index_data) + versions_len
+        )
+        offset = PAYLOAD_OFFSET
+        for part in payload_parts + [index_data] + versions_parts:
+            map_file[offset : offset + len(part)] = part
+            offset += len(part)
+        self.__write_payload_header(
+            _PayloadHeader(payload_len, len(index_data), versions_len, generation + 1)
+        )
+        self.__generation = generation + 1
+
+    def __write_payload_header(self, header):
+        """Write the payload header."""
+        _PAYLOAD_HEADER.pack_into(self.map_file, SUBHEADER_OFFSET, *header)
+
+    def _used_bytes(self):
+        """Bytes used by the header, the pickled dictionary, indexes and versions."""
+        header = self.__read_payload_header()
+        return (
+            PAYLOAD_OFFSET + header.payload_len + header.index_len + header.versions_len
+        )
+
+    def memory_stats(self, top=10):
+        """Report how the segment's memory is used.
+
+        Slack is the part of the segment past the saved dictionary,
+        page rounding and room to grow into, which is also what
+        fragmentation is made of as nothing in use is ever garbage.
+        Sizing the largest entries pickles every value.
+
+        :param top: Number of the largest entries to list.
+        :type top: :class:`int`
+        :rtype: :class:`shm_dict.segment.MemoryStats` whose largest_keys
+                are (key, bytes) of the entries with the largest
+                pickled (key, stored value).
+        """
+        with self.exclusive_lock():
+            entry_sizes = [
+                (key, len(pickle.dumps((key, stored), 2)))
+                for key, stored in self.__internal_dict.items()
+            ]
+            return self._memory_stats(
+                self.__read_payload_header().payload_len,
+                len(entry_sizes),
+                entry_sizes,
+                top=top,
+            )
+
+    def __changed(self):
+        """True unless the segment holds what this handle last loaded or saved."""
+        return self.__read_payload_header().generation != self.__generation
+
+    def _lock_outermost(self):
+        """Take the semaphore and load the dictionary for the outermost lock.
 
         Loads dictionary data from memory or disk (if persistent) to
-        ensure data is up to date when lock is requested.
-
-        .. warnings also::
-            MacOS has a number of shortcomings with regards to
-            semaphores and shared memory segments, this is one
-            method contains one of them.
-
-                When the timeout is > 0, the call will wait no longer than
-                timeout seconds before either returning (having acquired
-                the semaphore) or raising a BusyError.
-                On platforms that don't support the sem_timedwait() API,
-                a timeout > 0 is treated as infinite. The call will not
-                return until its wait condition is satisfied.
-                Most platforms provide sem_timedwait(). macOS is a notable
-                exception. The module's Boolean constant
-                SEMAPHORE_TIMEOUT_SUPPORTED is True on platforms that
-                support sem_timedwait().
-
-                -- http://semanchuk.com/philip/posix_ipc/
+        ensure data is up to date when the lock is requested, unless no
+        handle has saved since this one last loaded or saved, so threads
+        sharing a handle share the loaded dictionary too. Nested locks
+        keep working on the already loaded dictionary.
         """
-        if self.__thread_local.semaphore is False:
-            try:
-                self.semaphore.acquire(self.lock_timeout)
-                self.__thread_local.semaphore = True
-            except posix_ipc.BusyError:
-                if self.auto_unlock is True:
-                    self.__thread_local.semaphore = True
-                else:
-                    six.reraise(*sys.exc_info())
-
-        self.__load_dict()
-
-    def _release_lock(self):
-        """Release the exclusive semaphore lock."""
-        if self.__thread_local.semaphore is True:
-            self.__save_dict()
-            self.semaphore.release()
-            self.__thread_local.semaphore = False
-
-    @contextmanager
-    def exclusive_lock(self):
-        """A context manager for the lock to allow with statements for exclusive access."""
-        self._acquire_lock()
-        yield
-        self._release_lock()
-
-    def __del__(self):
-        """Destroy the object nicely."""
-        self.map_file.close()
-        self.shared_mem.unlink()
-        self.semaphore.unlink()
+        if self.readonly is True:
+            # Read only handles never save so don't need to hold the
+            # semaphore if they can copy a consistent payload without it
+            if not self.__changed():
+                return
+            payload = self.__read_payload_lock_free()
+            if payload is not None and (payload.payload or self.persist_file is None):
+                self.__load_dict(payload)
+                return
+
+        super(SHMDict, self)._lock_outermost()
+        try:
+            if self.__changed():
+                self.__load_dict()
+            self.__apply_buffer()
+        except Exception:
+            self.__discard_changes()
+            self._release_semaphore()
+            raise
+
+    def _unlock_outermost(self, failed=False):
+        """Save any changes and hand back the semaphore.
+
+        Changes an exception escaping the lock left half made are rolled
+        back instead. If saving fails the changes are dropped, buffered
+        keys are buffered again as they were pickled once already.
+        """
+        try:
+            if self._semaphore_locked is True:
+                self.__save_changes(failed)
+        finally:
+            super(SHMDict, self)._unlock_outermost(failed)
+        if self.__warm_up_pending is True:
+            self.__warm_up_pending = False
+            self.__start_warm_up()
 
     def __setitem__(self, key, value):
         """Set a key in the dictionary to a value."""
+        self._check_writable()
+        stored = self.__to_store(value)
+        if self.__buffering() and not self._holds_lock():
+            self.__buffer_write(key, stored, value)
+            return
         with self.exclusive_lock():
-            self.__internal_dict[key] = value
-            self.__dirty = True
+            self.__store(key, stored, value)
+
+    def __buffering(self):
+        """True if keys set through this handle are published write behind."""
+        return self.write_behind is not None or self.flush_interval is not None
+
+    def __buffer_write(self, key, stored, value):
+        """Buffer a set key, publishing the buffer if it is full."""
+        self._check_open()
+        with self.__buffer_lock:
+            self.__buffer[key] = (stored, value)
+            _buffering_handles[id(self)] = self
+            full = (
+                self.write_behind is not None
+                and len(self.__buffer) >= self.write_behind
+            )
+            if not full:
+                self.__start_flush_timer()
+        if full:
+            self.flush()
+
+    def __start_flush_timer(self):
+        """Start the flush_interval timer, under the buffer lock, unless running."""
+        if self.flush_interval is None or self.__flush_timer is not None:
+            return
+        # A daemon so it doesn't hold up exiting, the last writes are
+        # published by _flush_at_exit instead
+        self.__flush_timer = threading.Timer(self.flush_interval, self.__flush_later)
+        self.__flush_timer.daemon = True
+        self.__flush_timer.start()
+
+    def __cancel_flush_timer(self):
+        """Stop the flush_interval timer, under the buffer lock."""
+        if self.__flush_timer is not None:
+            self.__flush_timer.cancel()
+            self.__flush_timer = None
+
+    def __flush_later(self):
+        """Publish the buffer from the flush_interval timer."""
+        with self.__buffer_lock:
+            self.__flush_timer = None
+        if self._closed is True:
+            return
+        try:
+            self.flush()
+        except posix_ipc.BusyError:
+            logger.debug("Retrying flush of %s, it is locked", self.name)
+        except Exception:  # pylint: disable=broad-except
+            # Nobody would see it raised from the timer's thread
+            logger.exception("Retrying flush of %s, it failed", self.name)
+        with self.__buffer_lock:
+            if self.__buffer:
+                self.__start_flush_timer()
+
+    def __apply_buffer(self):
+        """Store every buffered key, under the caller's lock.
+
+        They are tracked apart from changes made under the lock so those
+        can be rolled back without losing the buffered keys. Values were
+        pickled when buffered, but a key can still be turned down by an
+        index added since. It is dropped, and logged, as it would fail
+        every lock from then on, the other keys are stored regardless.
+        """
+        with self.__buffer_lock:
+            buffered, self.__buffer = self.__buffer, {}
+            self.__cancel_flush_timer()
+        if not buffered:
+            return
+        dirty = self.__dirty
+        for key, (stored, value) in list(six.iteritems(buffered)):
+            try:
+                self.__store(key, stored, value)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Dropped buffered key %r of %s", key, self.name)
+                del buffered[key]
+        self.__dirty = dirty
+        self.__applied.update(buffered)
+
+    def flush(self):
+        """Publish the keys buffered by write_behind or flush_interval now.
+
+        Buffered keys are only held by this handle until they are
+        published, other handles and processes don't see them before.
+        The handle itself always reads its own writes, as taking its
+        lock for anything, reads included, stores the buffered keys
+        first and publishes them when the lock is handed back. Keys set
+        while this thread already holds the lock aren't buffered. Closing
+        the handle, or the interpreter exiting, flushes it, destroying it
+        discards the buffer.
+
+        :raises posix_ipc.BusyError: If the lock can't be taken, the
+                                     keys stay buffered.
+        """
+        if not self.__buffer and not self._holds_lock():
+            return
+        with self.exclusive_lock():
+            self.__apply_buffer()
+
+    def __to_store(self, value):
+        """Return value as stored, compressed if configured to or else copied.
+
+        Done before taking the lock to keep lock hold times short.
+        """
+        if self.compression is not None:
+            stored = compress_value(value, self.compression, self.compress_threshold)
+            if stored is not value:
+                return stored
+        return _private_copy(value)
+
+    def __store(self, key, stored, value):
+        """Store a value under the caller's lock and stamp a new version.
+
+        :return: The key's new version.
+        """
+        # Indexes first, they raise for keys or values they can't take
+        indexes = self.__indexes_to_maintain()
+        if indexes is not None:
+            indexes.set(key, value)
+        self.__internal_dict[key] = stored
+        version = max(_monotonic_ns(), self.__versions.get(key, 0) + 1)
+        self.__versions[key] = version
+        self.__dirty = True
+        return version
+
+    def get_with_version(self, key):
+        """Return a value along with the version it was stored as.
+
+        The version changes whenever the key is set, through any handle,
+        so it can be handed to :meth:`put_if_version` to write a value
+        computed outside the lock back only if nobody changed the key in
+        the meantime. Keys not set since their dictionary was loaded
+        from its persist file are at version 0.
+
+        :param key: Key to look up.
+        :return: (value, version)
+        :raises KeyError: If the key isn't in the dictionary.
+        """
+        with self.exclusive_lock():
+            stored = self.__internal_dict[key]
+            version = self.__versions.get(key, 0)
+        return _read_value(stored), version
+
+    def put_if_version(self, key, value, version):
+        """Set a key to a value only if it is still at version.
+
+        :param key: Key to set.
+        :param value: Value to set it to.
+        :param version: Version from :meth:`get_with_version`, or None
+                        to only set the key if it doesn't exist.
+        :type version: :class:`int` or None
+        :return: The key's new version, or None if it had changed and
+                 nothing was written.
+        """
+        self._check_writable()
+        stored = self.__to_store(value)
+        with self.exclusive_lock():
+            if version is None:
+                if key in self.__internal_dict:
+                    return None
+            elif (
+                key not in self.__internal_dict
+                or self.__versions.get(key, 0) != version
+            ):
+                return None
+            return self.__store(key, stored, value)
 
     def __getitem__(self, key):
         """Get the value of a key from the dictionary."""
         with self.exclusive_lock():
-            return self.__internal_dict[key]
+            value = self.__internal_dict[key]
+        return _read_value(value)
 
     def __repr__(self):
         """Represent the dictionary in a human readable format."""
-        with self.exclusive_lock():
-            return repr(self.__internal_dict)
+        return repr(self.copy())
 
     def __len__(self):
         """Return the length of the dictionary."""
@@ -266,20 +850,180 @@ class SHMDict(MutableMapping):
 
     def __delitem__(self, key):
         """Remove an item from the dictionary."""
+        self._check_writable()
         with self.exclusive_lock():
             del self.__internal_dict[key]
+            indexes = self.__indexes_to_maintain()
+            if indexes is not None:
+                indexes.delete(key)
+            self.__versions.pop(key, None)
             self.__dirty = True
 
     def clear(self):
         """Completely clear the dictionary."""
+        self._check_writable()
         with self.exclusive_lock():
             self.__dirty = True
+            indexes = self.__indexes_to_maintain()
+            if indexes is not None:
+                indexes.clear()
+            self.__versions.clear()
             return self.__internal_dict.clear()
 
     def copy(self):
         """Create and return a copy of the internal dictionary."""
         with self.exclusive_lock():
-            return self.__internal_dict.copy()
+            internal_copy = self.__internal_dict.copy()
+        return dict((key, _read_value(value)) for key, value in internal_copy.items())
+
+    def __snapshot(self):
+        """Return a plain dictionary of the stored values.
+
+        Only the raw payload bytes are copied while holding the
+        semaphore, they are unpickled after handing it back. A handle
+        already holding the lock, or a dictionary still being read
+        lazily from its persist file or with writes buffered, is copied
+        under the lock instead.
+        """
+        if not self._holds_lock() and not self.__buffer:
+            with self._semaphore_held():
+                map_file = self.map_file
+                payload_len = self.__read_payload_header().payload_len
+                payload = map_file[PAYLOAD_OFFSET : PAYLOAD_OFFSET + payload_len]
+            if payload_len > 0 or self.persist_file is None:
+                return pickle.loads(payload) if payload else {}  # nosec
+
+        with self.exclusive_lock():
+            return dict(self.__internal_dict.items())
+
+    def dump(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Stream a consistent snapshot of the dictionary to a file object.
+
+        Writers are only held up while the snapshot is copied out of the
+        segment, not while it is written. Values are written as stored,
+        so compressed values stay compressed.
+
+        :param fileobj: Binary file object to write to.
+        :param chunk_size: Bytes of entries to write per chunk.
+        :type fileobj: :class:`io.BufferedIOBase`
+        :type chunk_size: :class:`int`
+        :return: Number of entries written.
+        """
+        return dump_stream(six.iteritems(self.__snapshot()), fileobj, chunk_size)
+
+    @classmethod
+    def load(cls, fileobj, name, **kwargs):
+        """Open a dictionary and replace its contents with a dumped stream.
+
+        The stream is read in full before taking the lock, then published
+        in one go, so other handles see either the old contents or all
+        of the loaded ones.
+
+        :param fileobj: Binary file object written by :meth:`dump`.
+        :param name: Name of the dictionary to load into.
+        :param kwargs: Any other :class:`SHMDict` arguments.
+        :type fileobj: :class:`io.BufferedIOBase`
+        :type name: :class:`str`
+        :return: The :class:`SHMDict` loaded into.
+        :raises ValueError: If fileobj isn't a supported stream.
+        """
+        entries = list(load_stream(fileobj))
+        shm_dict = cls(name, **kwargs)
+        try:
+            shm_dict.__replace(entries)
+        except Exception:
+            exc_info = sys.exc_info()
+            try:
+                shm_dict.close()
+                six.reraise(*exc_info)
+            finally:
+                del exc_info
+        return shm_dict
+
+    def __replace(self, entries):
+        """Replace every entry with (key, stored value) pairs under one lock."""
+        self._check_writable()
+        with self.exclusive_lock():
+            self.__internal_dict.clear()
+            indexes = self.__indexes_to_maintain()
+            if indexes is not None:
+                indexes.clear()
+            self.__versions.clear()
+            for key, stored in entries:
+                value = decompress_value(stored) if indexes is not None else stored
+                self.__store(key, stored, value)
+
+    def close(self):
+        """Publish any buffered keys and detach from the segment."""
+        if self._closed is not True:
+            self.flush()
+        super(SHMDict, self).close()
+
+    def _close_handles(self, unlink=False):
+        """Stop the flush_interval timer and close the handles."""
+        with self.__buffer_lock:
+            self.__cancel_flush_timer()
+            _buffering_handles.pop(id(self), None)
+        super(SHMDict, self)._close_handles(unlink=unlink)
+
+    @classmethod
+    def from_iterable(cls, name, iterable, workers=None, **kwargs):
+        """Open a dictionary and replace its contents with (key, value) pairs.
+
+        Entries are compressed, if the handle is configured to, and
+        pickled by a pool of worker processes before taking the lock.
+        The pickled parts are then written straight into the segment,
+        grown once to fit them all, so other handles see either the old
+        contents or all of the new ones.
+
+        :param name: Name of the dictionary to fill.
+        :param iterable: (key, value) pairs, later keys win.
+        :param workers: Number of processes to pickle in, the CPU count
+                        if None, in this process if 1.
+        :param kwargs: Any other :class:`SHMDict` arguments.
+        :type name: :class:`str`
+        :type workers: :class:`int` or None
+        :return: The filled :class:`SHMDict`.
+        """
+        entries = [tuple(entry) for entry in iterable]
+        shm_dict = cls(name, **kwargs)
+        try:
+            shm_dict.__bulk_replace(entries, workers)
+        except Exception:
+            exc_info = sys.exc_info()
+            try:
+                shm_dict.close()
+                six.reraise(*exc_info)
+            finally:
+                del exc_info
+        return shm_dict
+
+    def __bulk_replace(self, entries, workers):
+        """Replace every entry by publishing a dictionary pickled in parallel."""
+        self._check_writable()
+        version = _monotonic_ns()
+        payload_parts, versions_parts = _pickle_dict_parts(
+            entries, workers, version, self.compression, self.compress_threshold
+        )
+        with self.exclusive_lock():
+            if any(old_version >= version for old_version in self.__versions.values()):
+                # Keys must move on to a newer version than any they had
+                version = max(self.__versions.values()) + 1
+                versions_parts = [
+                    pickle.dumps(dict.fromkeys((key for key, _ in entries), version), 2)
+                ]
+            indexes = self.__indexes_to_maintain()
+            if indexes is not None:
+                indexes.rebuild(entries)
+            self.__publish(payload_parts, versions_parts)
+            self.__dirty = False
+            self.__applied = {}
+            # Load what was published the next time it is needed rather
+            # than unpickling it now, unless the persist file needs it
+            self.__generation = None
+            if self.persist_file is not None:
+                self.__load_dict()
+                dump_indexed(self.__internal_dict, self.persist_file)
 
     def has_key(self, key):
         """Return true if a key is in the internal dictionary."""
@@ -304,4 +1048,100 @@ class SHMDict(MutableMapping):
     def __iter__(self):
         """Iterate through the dictionary keys."""
         with self.exclusive_lock():
-            return iter(self.__internal_dict)
+            # A copy of the keys, the dictionary is shared with other
+            # threads and can be changed while iterating
+            return iter(list(self.__internal_dict))
+
+    def __sorted_keys(self):
+        """Sorted keys from the ordered index, or sorted on the spot."""
+        keys = self.__get_indexes().keys
+        if keys is not None:
+            return keys
+        return sorted(self.__internal_dict)
+
+    def __items(self, keys):
+        """Decompressed (key, value) pairs for keys, under the caller's lock."""
+        return [(key, _read_value(self.__internal_dict[key])) for key in keys]
+
+    def keys_with_prefix(self, prefix):
+        """Return the sorted str or bytes keys starting with prefix.
+
+        :param prefix: Prefix to match.
+        :type prefix: :class:`str` or :class:`bytes`
+        """
+        with self.exclusive_lock():
+            return keys_with_prefix(self.__sorted_keys(), prefix)
+
+    def range(self, low=None, high=None):
+        """Return the sorted keys k with low <= k < high.
+
+        :param low: Inclusive lower bound or None for no lower bound.
+        :param high: Exclusive upper bound or None for no upper bound.
+        """
+        with self.exclusive_lock():
+            return keys_in_range(self.__sorted_keys(), low, high)
+
+    def items_range(self, low=None, high=None):
+        """Return (key, value) sorted by key for keys k with low <= k < high.
+
+        :param low: Inclusive lower bound or None for no lower bound.
+        :param high: Exclusive upper bound or None for no upper bound.
+        """
+        with self.exclusive_lock():
+            return self.__items(keys_in_range(self.__sorted_keys(), low, high))
+
+    def add_index(self, name, key_func):
+        """Create or rebuild a secondary index over the values.
+
+        Every handle keeps the index up to date from then on, see
+        :class:`shm_dict.indexes.SecondaryIndex` for what key_func may be.
+
+        :param name: Name to query the index by.
+        :param key_func: Picklable callable taking a value and returning
+                         the hashable value to index it under, or None.
+        :type name: :class:`str`
+        :type key_func: :class:`callable`
+        :raises pickle.PicklingError: If key_func can't be pickled, like
+                                      a lambda. Python 3 raises
+                                      AttributeError for local
+                                      functions instead.
+        """
+        self._check_writable()
+        # Fail now rather than on every save from then on
+        pickle.dumps(key_func, 2)
+        with self.exclusive_lock():
+            self.__get_indexes().add_secondary(
+                name, key_func, self.__items(list(self.__internal_dict))
+            )
+            self.__dirty = True
+
+    def drop_index(self, name):
+        """Remove a secondary index.
+
+        :param name: Name the index was added as.
+        :type name: :class:`str`
+        """
+        self._check_writable()
+        with self.exclusive_lock():
+            del self.__get_indexes().secondary[name]
+            self.__dirty = True
+
+    def keys_where(self, name, index_value):
+        """Return the keys a secondary index has under index_value.
+
+        :param name: Name the index was added as.
+        :param index_value: Value key_func returned for the entries.
+        """
+        with self.exclusive_lock():
+            return self.__get_indexes().secondary[name].keys_where(index_value)
+
+    def items_where(self, name, index_value):
+        """Return (key, value) of the entries a secondary index has under index_value.
+
+        :param name: Name the index was added as.
+        :param index_value: Value key_func returned for the entries.
+        """
+        with self.exclusive_lock():
+            return self.__items(
+                self.__get_indexes().secondary[name].keys_where(index_value)
+            )
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+from collections import namedtuple
+import pickle  # nosec
+import struct
+import sys
+
+# Related third party imports (If you used pip/apt/yum to install)
+import posix_ipc
+import six
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from ._version import __version__
+from .segment import SUBHEADER_OFFSET, SHMSegment
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle-shm_dict@natrinicle.com"
+__status__ = "Production"
+
+# After the common segment header come the number of slots, the payload
+# bytes each slot holds, the next slot to read, the next slot to write,
+# the oldest slot not yet handed back to producers and the number of
+# items waiting. Slots start at SLOTS_OFFSET, each is a small header
+# (payload length, payload kind, slot state) followed by the payload.
+SLOTS_OFFSET = 64
+DEFAULT_CAPACITY = 1024
+DEFAULT_SLOT_SIZE = 4096
+
+_RING_HEADER = struct.Struct("<QQQQQQ")
+_RingHeader = namedtuple(
+    "_RingHeader", ["capacity", "slot_size", "head", "tail", "reclaim", "size"]
+)
+_SLOT_HEADER = struct.Struct("<IBB2x")
+
+# Payload kinds
+_BYTES = 0
+_PICKLED = 1
+
+# Slot states, a slot is only reused once it and every slot before it
+# have been consumed so zero copy views are never overwritten.
+_FREE = 0
+_FILLED = 1
+_CONSUMED = 2
+
+
+class SHMQueue(SHMSegment):
+    """Bounded multi producer, multi consumer queue in shared memory.
+
+    Items live in a ring of fixed size slots. Producers and consumers
+    block on counting semaphores for free slots and waiting items rather
+    than polling, and bytes items can be read without copying them out
+    of the segment.
+    """
+
+    segment_magic = b"SHMQ"
+
+    def __init__(
+        self,
+        name,
+        capacity=DEFAULT_CAPACITY,
+        slot_size=DEFAULT_SLOT_SIZE,
+        lock_timeout=30,
+        auto_unlock=False,
+    ):
+        """Standard init method.
+
+        :param name: Name for shared memory and semaphores.
+        :param capacity: Number of items the queue can hold, only used
+                         by the handle that creates the segment.
+        :param slot_size: Largest item in bytes, after pickling anything
+                          that isn't bytes, only used by the handle that
+                          creates the segment.
+        :param lock_timeout: Time in seconds before giving up on
+                             acquiring exclusive access to the ring.
+        :param auto_unlock: If the lock_timeout is hit, and this
+                            is True, automatically bypass the
+                            lock and use the ring anyway.
+        :type name: :class:`str`
+        :type capacity: :class:`int`
+        :type slot_size: :class:`int`
+        :type lock_timeout: :class:`int` or :class:`float`
+        :type auto_unlock: :class:`bool`
+        """
+        self._capacity = capacity
+        self._slot_size = slot_size
+        self._items_semaphore = None
+        self._slots_semaphore = None
+        self._producers_semaphore = None
+        self._held_slots = []
+        self._held_views = []
+
+        super(SHMQueue, self).__init__(
+            name, lock_timeout=lock_timeout, auto_unlock=auto_unlock
+        )
+        # Attach straight away so the ring is laid out with this handle's
+        # capacity and slot_size rather than whichever handle is used first
+        self.map_file
+
+    @property
+    def safe_items_sem_name(self):
+        """Unique name of the semaphore counting waiting items."""
+        return self._safe_name("items")
+
+    @property
+    def safe_slots_sem_name(self):
+        """Unique name of the semaphore counting free slots."""
+        return self._safe_name("slots")
+
+    @property
+    def safe_producers_sem_name(self):
+        """Unique name of the semaphore producers gather slots under."""
+        return self._safe_name("producers")
+
+    @property
+    def items_semaphore(self):
+        """Create or return the semaphore counting waiting items."""
+        if self._items_semaphore is None:
+            self.map_file
+            self._items_semaphore = posix_ipc.Semaphore(
+                self.safe_items_sem_name, flags=posix_ipc.O_CREAT, initial_value=0
+            )
+        return self._items_semaphore
+
+    @property
+    def slots_semaphore(self):
+        """Create or return the semaphore counting free slots."""
+        if self._slots_semaphore is None:
+            self._slots_semaphore = posix_ipc.Semaphore(
+                self.safe_slots_sem_name,
+                flags=posix_ipc.O_CREAT,
+                initial_value=self.capacity,
+            )
+        return self._slots_semaphore
+
+    @property
+    def producers_semaphore(self):
+        """Create or return the semaphore producers gather slots under."""
+        if self._producers_semaphore is None:
+            self._producers_semaphore = posix_ipc.Semaphore(
+                self.safe_producers_sem_name, flags=posix_ipc.O_CREAT, initial_value=1
+            )
+        return self._producers_semaphore
+
+    @property
+    def capacity(self):
+        """Number of items the queue can hold."""
+        return self.__read_ring_header().capacity
+
+    @property
+    def slot_size(self):
+        """Largest item in bytes the queue can hold."""
+        return self.__read_ring_header().slot_size
+
+    def _initialize_segment(self):
+        """Lay out an empty ring, dropping counters left by a crashed queue."""
+        for name in (
+            self.safe_items_sem_name,
+            self.safe_slots_sem_name,
+            self.safe_producers_sem_name,
+        ):
+            try:
+                posix_ipc.unlink_semaphore(name)
+            except posix_ipc.ExistentialError:
+                pass
+
+        self._resize(
+            SLOTS_OFFSET + self._capacity * self.__slot_stride(self._slot_size)
+        )
+        self.__write_ring_header(
+            _RingHeader(self._capacity, self._slot_size, 0, 0, 0, 0)
+        )
+        super(SHMQueue, self)._initialize_segment()
+
+    @staticmethod
+    def __slot_stride(slot_size):
+        """Bytes between the start of two consecutive slots."""
+        return _SLOT_HEADER.size + slot_size
+
+    def __read_ring_header(self):
+        """Read the ring header."""
+        return _RingHeader(*_RING_HEADER.unpack_from(self.map_file, SUBHEADER_OFFSET))
+
+    def __write_ring_header(self, header):
+        """Write the ring header."""
+        _RING_HEADER.pack_into(self.map_file, SUBHEADER_OFFSET, *header)
+
+    def __slot_offset(self, header, slot):
+        """Offset of a slot's header in the segment."""
+        return SLOTS_OFFSET + slot * self.__slot_stride(header.slot_size)
+
+    def _used_bytes(self):
+        """Bytes used by the header and the ring of slots."""
+        header = self.__read_ring_header()
+        return SLOTS_OFFSET + header.capacity * self.__slot_stride(header.slot_size)
+
+    def __encode(self, item, slot_size):
+        """Return (kind, payload) for an item, pickling anything but bytes."""
+        if isinstance(item, memoryview):
+            # Python 2 bytes() of a memoryview is its repr
+            kind, payload = _BYTES, item.tobytes()
+        elif isinstance(item, (bytes, bytearray)):
+            kind, payload = _BYTES, bytes(item)
+        else:
+            kind, payload = _PICKLED, pickle.dumps(item, 2)
+        if len(payload) > slot_size:
+            raise ValueError(
+                "Item of {} bytes doesn't fit {} byte slots of SHMQueue {}".format(
+                    len(payload), slot_size, self.name
+                )
+            )
+        return kind, payload
+
+    @staticmethod
+    def __acquire(semaphore, count, timeout):
+        """Acquire a counting semaphore count times.
+
+        Hands back what it did acquire and re-raises if the timeout hits
+        part way through, so callers never hold a partial batch.
+        """
+        acquired = 0
+        try:
+            while acquired < count:
+                semaphore.acquire(timeout)
+                acquired += 1
+        except posix_ipc.BusyError:
+            for _ in range(acquired):
+                semaphore.release()
+            six.reraise(*sys.exc_info())
+
+    def put(self, item, timeout=None):
+        """Put an item on the queue, blocking while it is full.
+
+        :param item: bytes are stored as is, anything else is pickled.
+        :param timeout: Seconds to wait for a free slot, None waits
+                        forever and 0 doesn't wait at all.
+        :raises posix_ipc.BusyError: If no slot freed up in time.
+        :raises ValueError: If the item is larger than a slot.
+        """
+        self.put_many([item], timeout=timeout)
+
+    def put_many(self, items, timeout=None):
+        """Put several items on the queue under a single lock acquisition.
+
+        Either every item is queued or, if not enough slots free up in
+        time, none are. Producers gather the slots for one batch at a
+        time, so batches waiting on each other for slots can't deadlock.
+
+        :param items: Iterable of items, see :meth:`put`.
+        :param timeout: Seconds to wait for other producers' batches,
+                        and then for each free slot.
+        :raises posix_ipc.BusyError: If not enough slots freed up in time.
+        :raises ValueError: If an item is larger than a slot, or there
+                            are more items than the queue can hold.
+        """
+        header = self.__read_ring_header()
+        encoded = [self.__encode(item, header.slot_size) for item in items]
+        if not encoded:
+            return
+        if len(encoded) > header.capacity:
+            raise ValueError(
+                "{} items can never fit the {} slots of SHMQueue {}".format(
+                    len(encoded), header.capacity, self.name
+                )
+            )
+
+        self.__acquire(self.producers_semaphore, 1, timeout)
+        try:
+            self.__acquire(self.slots_semaphore, len(encoded), timeout)
+        finally:
+            self.producers_semaphore.release()
+        with self.exclusive_lock():
+            map_file = self.map_file
+            header = self.__read_ring_header()
+            tail = header.tail
+            for kind, payload in encoded:
+                offset = self.__slot_offset(header, tail)
+                payload_start = offset + _SLOT_HEADER.size
+                map_file[payload_start : payload_start + len(payload)] = payload
+                _SLOT_HEADER.pack_into(map_file, offset, len(payload), kind, _FILLED)
+                tail = (tail + 1) % header.capacity
+            self.__write_ring_header(
+                header._replace(tail=tail, size=header.size + len(encoded))
+            )
+
+        for _ in encoded:
+            self.items_semaphore.release()
+
+    def get(self, timeout=None, copy=True):
+        """Take the oldest item off the queue, blocking while it is empty.
+
+        :param timeout: Seconds to wait for an item, None waits forever
+                        and 0 doesn't wait at all.
+        :param copy: If False bytes items are returned as a read only
+                     :class:`memoryview` of the slot, valid until the
+                     next get or :meth:`release` on this handle.
+                     Python 2 mmaps can't be viewed, so they are
+                     always copied there.
+        :raises posix_ipc.BusyError: If no item arrived in time.
+        """
+        return self.get_many(1, timeout=timeout, copy=copy)[0]
+
+    def get_many(self, max_items, timeout=None, copy=True):
+        """Take up to max_items off the queue under a single lock acquisition.
+
+        Waits for at least one item, then takes whatever else is already
+        waiting up to max_items.
+
+        :param max_items: Most items to return.
+        :param timeout: Seconds to wait for the first item.
+        :param copy: See :meth:`get`.
+        :raises posix_ipc.BusyError: If no item arrived in time.
+        """
+        self.release()
+        self.__acquire(self.items_semaphore, 1, timeout)
+        count = 1
+        while count < max_items:
+            try:
+                self.items_semaphore.acquire(0)
+            except posix_ipc.BusyError:
+                break
+            count += 1
+
+        items = []
+        with self.exclusive_lock():
+            map_file = self.map_file
+            header = self.__read_ring_header()
+            head = header.head
+            consumed = []
+            for _ in range(count):
+                offset = self.__slot_offset(header, head)
+                length, kind, _ = _SLOT_HEADER.unpack_from(map_file, offset)
+                payload_start = offset + _SLOT_HEADER.size
+                payload_end = payload_start + length
+                if kind == _PICKLED:
+                    items.append(
+                        pickle.loads(map_file[payload_start:payload_end])  # nosec
+                    )
+                    consumed.append(head)
+                elif copy is True or six.PY2:
+                    items.append(map_file[payload_start:payload_end])
+                    consumed.append(head)
+                else:
+                    whole = memoryview(map_file)
+                    view = whole[payload_start:payload_end]
+                    if hasattr(view, "toreadonly"):
+                        items.append(view.toreadonly())
+                        view.release()
+                        whole.release()
+                    else:
+                        # Python < 3.8 can't make a read only view of a
+                        # writable mapping
+                        items.append(view)
+                    self._held_views.append(items[-1])
+                    self._held_slots.append(head)
+                head = (head + 1) % header.capacity
+            header = header._replace(head=head, size=header.size - count)
+            self.__write_ring_header(self.__consume(map_file, header, consumed))
+        return items
+
+    def __consume(self, map_file, header, slots):
+        """Mark slots consumed and hand reclaimable slots back to producers.
+
+        :return: The ring header with reclaim advanced.
+        """
+        for slot in slots:
+            offset = self.__slot_offset(header, slot)
+            length, kind, _ = _SLOT_HEADER.unpack_from(map_file, offset)
+            _SLOT_HEADER.pack_into(map_file, offset, length, kind, _CONSUMED)
+
+        reclaim = header.reclaim
+        freed = 0
+        while freed < header.capacity:
+            offset = self.__slot_offset(header, reclaim)
+            length, kind, state = _SLOT_HEADER.unpack_from(map_file, offset)
+            if state != _CONSUMED:
+                break
+            _SLOT_HEADER.pack_into(map_file, offset, length, kind, _FREE)
+            reclaim = (reclaim + 1) % header.capacity
+            freed += 1
+
+        for _ in range(freed):
+            self.slots_semaphore.release()
+        return header._replace(reclaim=reclaim)
+
+    def release(self):
+        """Hand back slots still held by zero copy views from this handle.
+
+        Any memoryview returned by ``get(copy=False)`` is released and
+        raises ValueError if used afterwards.
+        """
+        for view in self._held_views:
+            view.release()
+        self._held_views = []
+        if not self._held_slots:
+            return
+
+        with self.exclusive_lock():
+            header = self.__read_ring_header()
+            self.__write_ring_header(
+                self.__consume(self.map_file, header, self._held_slots)
+            )
+        self._held_slots = []
+
+    def qsize(self):
+        """Return the number of items waiting in the queue."""
+        with self.exclusive_lock():
+            return self.__read_ring_header().size
+
+    def empty(self):
+        """Return True if no items are waiting."""
+        return self.qsize() == 0
+
+    def full(self):
+        """Return True if every slot holds an item."""
+        with self.exclusive_lock():
+            header = self.__read_ring_header()
+            return header.size == header.capacity
+
+    def close(self):
+        """Hand back held slots and detach from the queue."""
+        if (
+            self._closed is not True
+            and self._map_file is not None
+            and not self._inherited()
+        ):
+            self.release()
+        super(SHMQueue, self).close()
+
+    def _close_handles(self, unlink=False):
+        """Release zero copy views and close, and if unlinking unlink, the semaphores.
+
+        The views have to go before the mapping can be closed, destroy
+        doesn't hand their slots back as the ring goes with it.
+        """
+        for view in self._held_views:
+            view.release()
+        self._held_views = []
+        for attr, name in (
+            ("_items_semaphore", self.safe_items_sem_name),
+            ("_slots_semaphore", self.safe_slots_sem_name),
+            ("_producers_semaphore", self.safe_producers_sem_name),
+        ):
+            semaphore = getattr(self, attr)
+            if unlink is True:
+                try:
+                    posix_ipc.unlink_semaphore(name)
+                except posix_ipc.ExistentialError:
+                    pass
+            if semaphore is not None:
+                semaphore.close()
+                setattr(self, attr, None)
+        super(SHMQueue, self)._close_handles(unlink=unlink)
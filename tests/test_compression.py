@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+import pickle
+
+# Related third party imports (If you used pip/apt/yum to install)
+import pytest
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from shm_dict.compression import (
+    CODECS,
+    CompressedValue,
+    check_codec,
+    compress_value,
+    decompress_value,
+)
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle@natrinicle.com"
+__status__ = "Production"
+
+
+class TestCompression(object):
+    @pytest.mark.parametrize("codec", sorted(CODECS))
+    def test_round_trip(self, codec):
+        value = {"blob": "x" * 4096, "list": list(range(100))}
+        compressed = compress_value(value, codec, 1024)
+
+        assert isinstance(compressed, CompressedValue)
+        assert len(compressed) < len(pickle.dumps(value, 2))
+        assert decompress_value(compressed) == value
+
+        # Survives being pickled into a segment or persist file
+        assert decompress_value(pickle.loads(pickle.dumps(compressed, 2))) == value
+
+    def test_threshold(self):
+        # Below the threshold values are returned untouched
+        assert compress_value("x" * 100, "zlib", 1024) == "x" * 100
+        assert compress_value(list(range(10)), "zlib", 1024) == list(range(10))
+
+        # Values that don't shrink aren't stored compressed
+        incompressible = "abcdefghijklmnopqrst"
+        assert compress_value(incompressible, "zlib", 1) is incompressible
+
+        assert decompress_value("plain") == "plain"
+
+    def test_check_codec(self):
+        check_codec("zlib")
+        with pytest.raises(ValueError, match=r".*not available.*"):
+            check_codec("snappy")
+        with pytest.raises(ValueError, match=r".*not available.*"):
+            decompress_value(CompressedValue("snappy", b""))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+import hashlib
+import os
+import struct
+import subprocess
+import sys
+
+# Related third party imports (If you used pip/apt/yum to install)
+import pytest
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from shm_dict.hashing import (
+    DEFAULT_HASHER,
+    HASHERS,
+    SEGMENT_HASHER,
+    KeyHasher,
+    check_hasher,
+    normalize_key,
+)
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle@natrinicle.com"
+__status__ = "Production"
+
+KEYS = ["key", b"key", 1, -300, 2 ** 70, 1.5, None, ("key", (1, b"key"))]
+
+
+class TestHashing(object):
+    def test_normalize_key(self):
+        # Keys equal in a dictionary normalise the same
+        assert normalize_key(1) == normalize_key(1.0) == normalize_key(True)
+        assert normalize_key(0) == normalize_key(-0.0)
+
+        # and keys that aren't don't
+        normalized = [normalize_key(key) for key in KEYS]
+        assert len(set(normalized)) == len(KEYS)
+        assert normalize_key(("a", "b")) != normalize_key(("ab",))
+
+        # Tuples are their length, then each element after its length
+        key = ("key", 1, 1.5, ("key",))
+        elements = [normalize_key(item) for item in key]
+        assert normalize_key(key) == b"".join(
+            [b"t", struct.pack("<I", len(key))]
+            + [struct.pack("<I", len(element)) + element for element in elements]
+        )
+
+        with pytest.raises(TypeError, match=r".*can't be hashed stably.*"):
+            normalize_key(["list"])
+        with pytest.raises(TypeError, match=r".*can't be hashed stably.*"):
+            normalize_key(("key", object()))
+
+    @pytest.mark.parametrize("hasher", sorted(HASHERS))
+    def test_key_hasher(self, hasher):
+        key_hasher = KeyHasher(1234, hasher)
+        for key in KEYS:
+            assert 0 <= key_hasher(key) < 2 ** 64
+            assert key_hasher(key) == KeyHasher(1234, hasher)(key)
+        assert key_hasher("key") != KeyHasher(1235, hasher)("key")
+        assert key_hasher("key") == key_hasher.hash_bytes(normalize_key("key"))
+
+    def test_stable_across_interpreters(self):
+        # Unlike hash(), which is randomized per interpreter
+        script = "from shm_dict.hashing import KeyHasher; print(KeyHasher(7)({!r}))"
+        hashes = set()
+        for hash_seed in ("1", "2"):
+            env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+            hashes.add(
+                subprocess.check_output(
+                    [sys.executable, "-c", script.format(KEYS[-1])], env=env
+                ).strip()
+            )
+        assert hashes == set([str(KeyHasher(7)(KEYS[-1])).encode("ascii")])
+
+        # and the default hasher is in hashlib on every interpreter
+        seeded = hashlib.sha256(struct.pack("<Q", 7) + normalize_key(KEYS[-1]))
+        assert KeyHasher(7)(KEYS[-1]) == struct.unpack_from("<Q", seeded.digest())[0]
+
+    def test_check_hasher(self):
+        assert DEFAULT_HASHER == "sha256"
+        check_hasher(DEFAULT_HASHER)
+        check_hasher(SEGMENT_HASHER)
+        with pytest.raises(ValueError, match=r".*not available.*"):
+            check_hasher("md5")
+        with pytest.raises(ValueError, match=r".*not available.*"):
+            KeyHasher(0, "md5")
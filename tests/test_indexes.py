@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+import operator
+import pickle
+
+# Related third party imports (If you used pip/apt/yum to install)
+import pytest
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from shm_dict.indexes import Indexes, keys_in_range, keys_with_prefix
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle@natrinicle.com"
+__status__ = "Production"
+
+
+class TestIndexes(object):
+    def test_keys_in_range(self):
+        keys = [1, 3, 5, 7, 9]
+        assert keys_in_range(keys) == keys
+        assert keys_in_range(keys, 3, 7) == [3, 5]
+        assert keys_in_range(keys, 4) == [5, 7, 9]
+        assert keys_in_range(keys, high=4) == [1, 3]
+        assert keys_in_range(keys, 10) == []
+
+    def test_keys_with_prefix(self):
+        keys = sorted(["a", "ab", "abc", "abd", "b", "ba"])
+        assert keys_with_prefix(keys, "ab") == ["ab", "abc", "abd"]
+        assert keys_with_prefix(keys, "b") == ["b", "ba"]
+        assert keys_with_prefix(keys, "c") == []
+        assert keys_with_prefix([b"x1", b"x2", b"y"], b"x") == [b"x1", b"x2"]
+
+    def test_maintenance(self):
+        indexes = Indexes()
+        assert not indexes
+
+        indexes.enable_ordered(["b", "a"])
+        indexes.add_secondary("parity", operator.itemgetter(0), [("a", [1])])
+        assert indexes
+        assert indexes.keys == ["a", "b"]
+
+        indexes.set("c", [0])
+        indexes.set("a", [0])
+        assert indexes.keys == ["a", "b", "c"]
+        assert sorted(indexes.secondary["parity"].keys_where(0)) == ["a", "c"]
+        assert indexes.secondary["parity"].keys_where(1) == []
+
+        # Nothing changes if any index can't take the key or value
+        with pytest.raises(TypeError):
+            indexes.set(1, [1])
+        with pytest.raises(TypeError):
+            indexes.set("d", None)
+        assert indexes.keys == ["a", "b", "c"]
+        assert indexes.secondary["parity"].keys_where(1) == []
+
+        indexes.delete("a")
+        indexes.delete("missing")
+        assert indexes.keys == ["b", "c"]
+        assert indexes.secondary["parity"].keys_where(0) == ["c"]
+
+        # Survives the round trip through shared memory
+        indexes = pickle.loads(pickle.dumps(indexes, 2))
+        assert indexes.secondary["parity"].keys_where(0) == ["c"]
+
+        indexes.clear()
+        assert indexes.keys == []
+        assert indexes.secondary["parity"].keys_where(0) == []
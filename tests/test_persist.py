@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+import io
+import os
+import pickle
+import struct
+
+# Related third party imports (If you used pip/apt/yum to install)
+import pytest
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from shm_dict.persist import (
+    INDEX_MAGIC,
+    STREAM_MAGIC,
+    LazyDict,
+    dump_indexed,
+    dump_stream,
+    load_persist_file,
+    load_stream,
+)
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle@natrinicle.com"
+__status__ = "Production"
+
+
+TEST_DICT = {"KEY0": "value", "KEY1": b"\x00" * 1024, ("tuple", 1): [1, 2, 3]}
+
+
+@pytest.fixture
+def persist_file(tmpdir):
+    """Indexed persist file holding TEST_DICT."""
+    path = os.path.join(str(tmpdir), "pytest_shm_dict_persist")
+    dump_indexed(TEST_DICT, path)
+    return path
+
+
+class TestPersist(object):
+    def test_indexed_format(self, persist_file):
+        with open(persist_file, "rb") as pfile:
+            contents = pfile.read()
+        assert contents.startswith(INDEX_MAGIC)
+        assert contents.endswith(INDEX_MAGIC)
+
+        # Written through a temp file which must not be left behind
+        assert os.listdir(os.path.dirname(persist_file)) == [
+            os.path.basename(persist_file)
+        ]
+
+    def test_lazy_load(self, persist_file):
+        lazy_dict = load_persist_file(persist_file)
+        assert isinstance(lazy_dict, LazyDict)
+
+        # Keys are known up front, values only once read
+        assert len(lazy_dict) == len(TEST_DICT)
+        assert set(lazy_dict) == set(TEST_DICT)
+        assert "KEY0" in lazy_dict
+        assert lazy_dict.loaded is False
+
+        for key, value in TEST_DICT.items():
+            assert lazy_dict[key] == value
+        assert lazy_dict.loaded is True
+        assert lazy_dict.copy() == TEST_DICT
+
+    def test_mutation(self, persist_file):
+        lazy_dict = load_persist_file(persist_file)
+
+        lazy_dict["KEY0"] = "new value"
+        lazy_dict["KEY2"] = "added"
+        del lazy_dict["KEY1"]
+        with pytest.raises(KeyError):
+            del lazy_dict["KEY1"]
+        with pytest.raises(KeyError):
+            lazy_dict["KEY1"]
+
+        expected = dict(TEST_DICT, KEY0="new value", KEY2="added")
+        del expected["KEY1"]
+        assert dict(lazy_dict) == expected
+
+        # Pickles as a plain dict so shared memory never sees a LazyDict
+        unpickled = pickle.loads(pickle.dumps(lazy_dict, 2))
+        assert type(unpickled) is dict
+        assert unpickled == expected
+
+        lazy_dict.clear()
+        assert len(lazy_dict) == 0
+
+    def test_rewrite_while_mapped(self, persist_file):
+        lazy_dict = load_persist_file(persist_file)
+
+        # Rewriting the file in place must not disturb the open mapping
+        dump_indexed(lazy_dict, persist_file)
+        assert lazy_dict.copy() == TEST_DICT
+        assert load_persist_file(persist_file).copy() == TEST_DICT
+
+    def test_legacy_pickle(self, tmpdir):
+        path = os.path.join(str(tmpdir), "pytest_shm_dict_legacy")
+        with open(path, "wb") as pfile:
+            pickle.dump(TEST_DICT, pfile, 2)
+
+        legacy_dict = load_persist_file(path)
+        assert type(legacy_dict) is dict
+        assert legacy_dict == TEST_DICT
+
+    def test_stream(self):
+        stream = io.BytesIO()
+        items = [("KEY{}".format(num), b"x" * num) for num in range(100)]
+
+        # Small chunks split the entries over several chunks
+        assert dump_stream(items, stream, chunk_size=256) == len(items)
+        contents = stream.getvalue()
+        assert contents.startswith(STREAM_MAGIC)
+        stream.seek(0)
+        assert list(load_stream(stream)) == items
+
+        stream = io.BytesIO()
+        assert dump_stream(TEST_DICT.items(), stream) == len(TEST_DICT)
+        stream.seek(0)
+        assert dict(load_stream(stream)) == TEST_DICT
+
+    def test_stream_errors(self):
+        stream = io.BytesIO()
+        dump_stream(TEST_DICT.items(), stream)
+        contents = stream.getvalue()
+
+        with pytest.raises(ValueError, match=r".*Not a shm_dict stream.*"):
+            list(load_stream(io.BytesIO(b"x" * len(contents))))
+        newer = contents[: len(STREAM_MAGIC)] + struct.pack("<H", 2)
+        with pytest.raises(ValueError, match=r".*version 2 is not supported.*"):
+            list(load_stream(io.BytesIO(newer + contents[len(newer) :])))
+        with pytest.raises(ValueError, match=r".*part way through a chunk.*"):
+            list(load_stream(io.BytesIO(contents[:-20])))
+        with pytest.raises(ValueError, match=r".*before its end chunk.*"):
+            list(load_stream(io.BytesIO(contents[:-4])))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+import mmap
+
+# Related third party imports (If you used pip/apt/yum to install)
+import posix_ipc
+import pytest
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from shm_dict import SHMBytesDict, SHMDict
+from shm_dict.hashing import SEGMENT_HASHER
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle@natrinicle.com"
+__status__ = "Production"
+
+
+class TestSHMBytesDict(object):
+
+    bytes_dict = None
+
+    def create_bytes_dict(self, **kwargs):
+        """Create a bytes only shared memory dictionary for testing."""
+        self.bytes_dict = SHMBytesDict("PyTestSHMBytesDict", lock_timeout=0, **kwargs)
+        return self.bytes_dict
+
+    def teardown_method(self, method):
+        if self.bytes_dict is not None:
+            self.bytes_dict.close()
+            self.bytes_dict = None
+
+    def test_types(self):
+        self.create_bytes_dict()
+        assert isinstance(self.bytes_dict, MutableMapping)
+
+        with pytest.raises(TypeError, match=r".*must be str or bytes.*"):
+            self.bytes_dict["key"] = 1
+        with pytest.raises(TypeError, match=r".*must be str or bytes.*"):
+            self.bytes_dict[1] = b"value"
+        with pytest.raises(TypeError, match=r".*must be str or bytes.*"):
+            SHMBytesDict("PyTestSHMBytesDict", value_type=int)
+
+        # str values are stored UTF-8 encoded and handed back as configured
+        self.bytes_dict["str"] = "välue"
+        assert self.bytes_dict["str"] == "välue".encode("utf-8")
+        with SHMBytesDict(
+            "PyTestSHMBytesDict", key_type=bytes, value_type=type("")
+        ) as str_view:
+            assert str_view[b"str"] == "välue"
+            assert list(str_view) == [b"str"]
+
+    def test_get_set_delete(self):
+        self.create_bytes_dict()
+        self.bytes_dict["key"] = b"value"
+        assert self.bytes_dict["key"] == b"value"
+        assert "key" in self.bytes_dict
+        assert "missing" not in self.bytes_dict
+        assert self.bytes_dict.get("missing") is None
+
+        # Replacing a value keeps a single entry
+        self.bytes_dict["key"] = b"replaced value"
+        assert self.bytes_dict["key"] == b"replaced value"
+        assert len(self.bytes_dict) == 1
+
+        del self.bytes_dict["key"]
+        assert len(self.bytes_dict) == 0
+        with pytest.raises(KeyError):
+            self.bytes_dict["key"]
+        with pytest.raises(KeyError):
+            del self.bytes_dict["key"]
+
+    def test_growth_and_reuse(self):
+        self.create_bytes_dict()
+        expected = {}
+        for num in range(500):
+            key = "KEY{}".format(num)
+            expected[key] = bytes(bytearray([num % 256])) * (num % 50)
+            self.bytes_dict[key] = expected[key]
+        assert self.bytes_dict.copy() == expected
+
+        # Deleted slots and replaced records are reclaimed on rebuild
+        for num in range(0, 500, 2):
+            del self.bytes_dict["KEY{}".format(num)]
+            del expected["KEY{}".format(num)]
+        for num in range(500, 1000):
+            key = "KEY{}".format(num)
+            expected[key] = b"x" * mmap.PAGESIZE
+            self.bytes_dict[key] = expected[key]
+
+        assert len(self.bytes_dict) == len(expected)
+        assert sorted(self.bytes_dict) == sorted(expected)
+        assert dict(self.bytes_dict.items()) == expected
+
+        # Clearing keeps the segment's capacity for the next fill
+        capacity = self.bytes_dict.usage().capacity
+        self.bytes_dict.clear()
+        assert len(self.bytes_dict) == 0
+        assert self.bytes_dict.usage().capacity == capacity
+        assert self.bytes_dict.usage().used <= mmap.PAGESIZE
+
+    def test_memory_stats(self):
+        self.create_bytes_dict()
+        self.bytes_dict["small"] = b"x"
+        self.bytes_dict["large"] = b"x" * 100
+        stats = self.bytes_dict.memory_stats(top=1)
+        assert stats.entries == 2
+        assert stats.garbage == 0
+        assert stats.largest_keys == [("large", 8 + 5 + 100)]
+        assert stats.payload_bytes == 8 + 5 + 1 + 8 + 5 + 100
+        assert stats.used + stats.slack == stats.segment_size
+
+        # Replaced records are garbage until the heap is rebuilt
+        self.bytes_dict["large"] = b"y" * 100
+        stats = self.bytes_dict.memory_stats()
+        assert stats.garbage == 8 + 5 + 100
+        assert stats.fragmentation == (
+            float(stats.slack + stats.garbage) / stats.segment_size
+        )
+
+    def test_shared_between_handles(self):
+        self.create_bytes_dict()
+        self.bytes_dict["key"] = b"value"
+
+        with SHMBytesDict("PyTestSHMBytesDict", lock_timeout=0) as peer:
+            assert peer["key"] == b"value"
+            for num in range(100):
+                peer["KEY{}".format(num)] = b"value"
+
+        # Growth by a peer is picked up by the original handle
+        assert len(self.bytes_dict) == 101
+
+        readonly = SHMBytesDict("PyTestSHMBytesDict", readonly=True)
+        assert readonly["KEY99"] == b"value"
+        with pytest.raises(TypeError, match=r".*read only.*"):
+            readonly["key"] = b"value"
+        readonly.close()
+
+    def test_segment_kind(self):
+        self.create_bytes_dict()
+        self.bytes_dict["key"] = b"value"
+
+        # A pickling SHMDict of the same name must not clobber the table
+        with pytest.raises(ValueError, match=r".*not created by a SHMDict.*"):
+            SHMDict("PyTestSHMBytesDict", lock_timeout=0)["key"]
+        assert self.bytes_dict["key"] == b"value"
+
+    def test_key_hasher(self):
+        self.create_bytes_dict(hash_seed=1234)
+        self.bytes_dict["key"] = b"value"
+        assert self.bytes_dict.key_hasher.seed == 1234
+        assert self.bytes_dict.key_hasher.hasher == SEGMENT_HASHER
+
+        # Every other handle hashes with the seed stored in the segment
+        with SHMBytesDict(
+            "PyTestSHMBytesDict", lock_timeout=0, hash_seed=5678
+        ) as peer_dict:
+            assert peer_dict.key_hasher.seed == 1234
+            assert peer_dict["key"] == b"value"
+
+        # Which survives the table being cleared and rebuilt
+        self.bytes_dict.clear()
+        for num in range(100):
+            self.bytes_dict["KEY{}".format(num)] = b"value"
+        assert self.bytes_dict.key_hasher.seed == 1234
+
+        with pytest.raises(ValueError, match=r".*not available.*"):
+            SHMBytesDict("PyTestSHMBytesDict", hasher="md5")
@@ -6,14 +6,22 @@ try:
 except ImportError:
     from collections import MutableMapping
 
+import hashlib
+import io
 from math import ceil
 import mmap
+import operator
 import mock
 import os
 import pickle
 from random import SystemRandom
 import re
+import struct
+import subprocess
+import sys
 from string import ascii_letters as str_ascii_letters, digits as str_digits
+import threading
+import time
 
 # Related third party imports (If you used pip/apt/yum to install)
 import posix_ipc
@@ -23,6 +31,8 @@ import pytest
 import shm_dict
 from shm_dict import SHMDict
 from shm_dict import __version__
+from shm_dict.segment import SUBHEADER_OFFSET
+from shm_dict.shm_dict import PAYLOAD_OFFSET
 
 __author__ = "Nate Bohman"
 __credits__ = ["Nate Bohman"]
@@ -83,10 +93,13 @@ class TestSHMDict(object):
     per_shm_dict = None
     vol_shm_dict = None
 
-    def create_per_shm_dict(self, temp_dir):
+    def create_per_shm_dict(self, temp_dir, warm_up=False):
         """Create a persistent shared memory dictionary for testing."""
         self.per_shm_dict = SHMDict(
-            self.dict_filename(temp_dir), persist=True, lock_timeout=0
+            self.dict_filename(temp_dir),
+            persist=True,
+            lock_timeout=0,
+            warm_up=warm_up,
         )
         return self.per_shm_dict
 
@@ -174,6 +187,26 @@ class TestSHMDict(object):
         assert B64_INVALID_CHARS.search(self.per_shm_dict.safe_sem_name) is None
         assert B64_INVALID_CHARS.search(self.per_shm_dict.safe_shm_name) is None
 
+    def test_lazy_handle(self):
+        # Nothing is created until the handle is used
+        shm_dict_handle = SHMDict("PyTestSHMDictLazy")
+        with mock.patch("hashlib.sha512", wraps=hashlib.sha512) as sha512:
+            assert shm_dict_handle.safe_sem_name == shm_dict_handle.safe_sem_name
+            assert shm_dict_handle.safe_shm_name == shm_dict_handle.safe_shm_name
+            assert sha512.call_count == 2
+        assert shm_dict_handle._semaphore is None
+        assert shm_dict_handle._shared_mem is None
+        with pytest.raises(posix_ipc.ExistentialError):
+            posix_ipc.SharedMemory(shm_dict_handle.safe_shm_name)
+        with pytest.raises(posix_ipc.ExistentialError):
+            posix_ipc.Semaphore(shm_dict_handle.safe_sem_name)
+        shm_dict_handle.close()
+
+        # The open shared memory object is reused once it is
+        with SHMDict("PyTestSHMDictLazy") as shm_dict_handle:
+            shm_dict_handle["key"] = "value"
+            assert shm_dict_handle.shared_mem is shm_dict_handle.shared_mem
+
     def test_persistent_file(self, tmpdir, dict_key):
         """Test that a persistent file is written to disk """
         test_rand_string = rand_string(10)
@@ -283,40 +316,42 @@ class TestSHMDict(object):
         test_rand_string_long = rand_string(mmap.PAGESIZE * 4)
         self.create_vol_shm_dict()
 
+        def check_size(previous_size):
+            """Segment holds the payload, never shrinks and at most doubles."""
+            used = self.vol_shm_dict.usage().used
+            assert used > PAYLOAD_OFFSET + len(
+                pickle.dumps(self.vol_shm_dict.copy(), 2)
+            )
+            needed = int(ceil(float(used) / mmap.PAGESIZE) * mmap.PAGESIZE)
+            size = self.vol_shm_dict.map_file.size()
+            assert self.vol_shm_dict.usage().capacity == size
+            assert size >= max(needed, previous_size)
+            assert size == previous_size or size <= max(needed, previous_size * 2)
+            return size
+
         # Test short, medium, and long size storage
         self.vol_shm_dict[dict_key] = test_rand_string_short
         assert self.vol_shm_dict[dict_key] == test_rand_string_short
-        assert self.vol_shm_dict.map_file.size() == int(
-            ceil(float(len(pickle.dumps(self.vol_shm_dict.copy(), 2))) / mmap.PAGESIZE)
-            * mmap.PAGESIZE
-        )
+        size = check_size(0)
 
         self.vol_shm_dict[dict_key] = test_rand_string_medium
         assert self.vol_shm_dict[dict_key] == test_rand_string_medium
-        assert self.vol_shm_dict.map_file.size() == int(
-            ceil(float(len(pickle.dumps(self.vol_shm_dict.copy(), 2))) / mmap.PAGESIZE)
-            * mmap.PAGESIZE
-        )
+        size = check_size(size)
 
         self.vol_shm_dict[dict_key] = test_rand_string_long
         assert self.vol_shm_dict[dict_key] == test_rand_string_long
-        assert self.vol_shm_dict.map_file.size() == int(
-            ceil(float(len(pickle.dumps(self.vol_shm_dict.copy(), 2))) / mmap.PAGESIZE)
-            * mmap.PAGESIZE
-        )
+        size = check_size(size)
 
         # Test short + medium and short + medium + long storage
-        # Ensures that dict resizes map_file down first and then back up
+        # Ensures that dict keeps map_file's size when the payload
+        # shrinks and only grows it when it no longer fits
         self.vol_shm_dict[dict_key] = "".join(
             [test_rand_string_short, test_rand_string_medium]
         )
         assert self.vol_shm_dict[dict_key] == "".join(
             [test_rand_string_short, test_rand_string_medium]
         )
-        assert self.vol_shm_dict.map_file.size() == int(
-            ceil(float(len(pickle.dumps(self.vol_shm_dict.copy(), 2))) / mmap.PAGESIZE)
-            * mmap.PAGESIZE
-        )
+        assert check_size(size) == size
 
         self.vol_shm_dict[dict_key] = "".join(
             [test_rand_string_short, test_rand_string_medium, test_rand_string_long]
@@ -324,10 +359,35 @@ class TestSHMDict(object):
         assert self.vol_shm_dict[dict_key] == "".join(
             [test_rand_string_short, test_rand_string_medium, test_rand_string_long]
         )
-        assert self.vol_shm_dict.map_file.size() == int(
-            ceil(float(len(pickle.dumps(self.vol_shm_dict.copy(), 2))) / mmap.PAGESIZE)
-            * mmap.PAGESIZE
+        check_size(size)
+
+    def test_preallocate(self, dict_key):
+        with pytest.raises(ValueError, match=r".*access must be one of.*"):
+            SHMDict("PyTestSHMDict", access="backwards")
+
+        self.vol_shm_dict = SHMDict(
+            "PyTestSHMDict",
+            lock_timeout=0,
+            preallocate=mmap.PAGESIZE * 64,
+            populate=True,
+            huge_pages=True,
+            access="random",
         )
+        capacity = mmap.PAGESIZE * 64
+        assert self.vol_shm_dict.usage() == (capacity, PAYLOAD_OFFSET)
+
+        # Writes within the preallocated capacity never remap
+        for num in range(8):
+            self.vol_shm_dict["{}{}".format(dict_key, num)] = rand_string(
+                mmap.PAGESIZE * 4
+            )
+        usage = self.vol_shm_dict.usage()
+        assert usage.capacity == capacity
+        assert usage.used > mmap.PAGESIZE * 32
+
+        # Other handles see the preallocated segment without growing it
+        with SHMDict("PyTestSHMDict", readonly=True) as ro_shm_dict:
+            assert ro_shm_dict.usage() == usage
 
     def test_clear(self, dict_key):
         test_rand_string = rand_string(10)
@@ -358,3 +418,758 @@ class TestSHMDict(object):
         self.vol_shm_dict.auto_unlock = True
 
         repr(self.vol_shm_dict)
+
+    def test_nested_lock(self, dict_key):
+        test_rand_string = rand_string(10)
+        self.create_vol_shm_dict()
+
+        with mock.patch.object(
+            SHMDict,
+            "_SHMDict__load_dict",
+            autospec=True,
+            side_effect=SHMDict._SHMDict__load_dict,
+        ) as load_dict:
+            with self.vol_shm_dict.exclusive_lock():
+                self.vol_shm_dict[dict_key] = test_rand_string
+                assert self.vol_shm_dict[dict_key] == test_rand_string
+
+                # Inner locks neither reload nor release the semaphore
+                assert self.vol_shm_dict.semaphore.value == 0
+            assert load_dict.call_count == 1
+            load_dict.reset_mock()
+        assert self.vol_shm_dict.semaphore.value == 1
+
+        with SHMDict("PyTestSHMDict", lock_timeout=0) as peer_shm_dict:
+            assert peer_shm_dict[dict_key] == test_rand_string
+
+    def test_threads(self, dict_key):
+        self.vol_shm_dict = SHMDict("PyTestSHMDict", lock_timeout=10)
+        self.vol_shm_dict[dict_key] = 0
+
+        def increment():
+            for _ in range(50):
+                with self.vol_shm_dict.exclusive_lock():
+                    self.vol_shm_dict[dict_key] += 1
+
+        with mock.patch.object(
+            SHMDict,
+            "_SHMDict__load_dict",
+            autospec=True,
+            side_effect=SHMDict._SHMDict__load_dict,
+        ) as load_dict:
+            # Threads sharing a handle take turns and share its loaded dict
+            threads = [threading.Thread(target=increment) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert self.vol_shm_dict[dict_key] == 400
+            assert load_dict.call_count == 0
+
+            # Until another handle saves
+            with SHMDict("PyTestSHMDict", lock_timeout=0) as peer_shm_dict:
+                peer_shm_dict[dict_key] = 0
+            assert self.vol_shm_dict[dict_key] == 0
+            assert load_dict.call_count == 2
+            load_dict.reset_mock()
+
+        # A thread can't take the lock held by another
+        with self.vol_shm_dict.exclusive_lock():
+            errors = []
+
+            def lock():
+                self.vol_shm_dict.lock_timeout = 0
+                try:
+                    len(self.vol_shm_dict)
+                except posix_ipc.BusyError:
+                    errors.append(posix_ipc.BusyError)
+
+            thread = threading.Thread(target=lock)
+            thread.start()
+            thread.join()
+            assert len(errors) == 1
+
+        # Iterating goes over a copy of the keys, which can be changed meanwhile
+        self.vol_shm_dict.lock_timeout = 0
+        for key in self.vol_shm_dict:
+            self.vol_shm_dict[key + "x"] = 1
+        assert sorted(self.vol_shm_dict) == [dict_key, dict_key + "x"]
+        for key in self.vol_shm_dict:
+            del self.vol_shm_dict[key]
+        assert len(self.vol_shm_dict) == 0
+
+    def test_returned_values(self, dict_key):
+        self.create_vol_shm_dict()
+        self.vol_shm_dict[dict_key] = [1]
+
+        # Changing a value read back, or one after setting it, changes
+        # neither the handle's dictionary nor what later saves publish
+        value = self.vol_shm_dict[dict_key]
+        value.append(2)
+        value, version = self.vol_shm_dict.get_with_version(dict_key)
+        value.append(3)
+        self.vol_shm_dict.copy()[dict_key].append(4)
+        new_value = [5]
+        self.vol_shm_dict["other"] = new_value
+        new_value.append(6)
+        assert self.vol_shm_dict[dict_key] == [1]
+        assert self.vol_shm_dict["other"] == [5]
+        with SHMDict("PyTestSHMDict", lock_timeout=0) as peer_shm_dict:
+            assert peer_shm_dict[dict_key] == [1]
+            assert peer_shm_dict["other"] == [5]
+        assert self.vol_shm_dict.put_if_version(dict_key, value, version)
+        assert self.vol_shm_dict[dict_key] == [1, 3]
+
+    def test_failed_lock(self, dict_key):
+        self.create_vol_shm_dict()
+        self.vol_shm_dict[dict_key] = 0
+
+        # A value that can't be pickled is turned down straight away
+        with pytest.raises(TypeError):
+            self.vol_shm_dict["lock"] = threading.Lock()
+        assert "lock" not in self.vol_shm_dict
+
+        # Changes that fail to save are dropped rather than failing
+        # every later lock on the handle
+        with mock.patch.object(SHMDict, "_resize", side_effect=OSError):
+            with pytest.raises(OSError):
+                self.vol_shm_dict["unsaved"] = 1
+        assert "unsaved" not in self.vol_shm_dict
+        self.vol_shm_dict[dict_key] = 1
+        assert self.vol_shm_dict[dict_key] == 1
+
+        # Changes made under a lock an exception escapes are rolled back
+        with pytest.raises(RuntimeError):
+            with self.vol_shm_dict.exclusive_lock():
+                self.vol_shm_dict[dict_key] = 2
+                raise RuntimeError("half made")
+        assert self.vol_shm_dict[dict_key] == 1
+
+        # without losing buffered keys
+        with SHMDict(
+            "PyTestSHMDict", lock_timeout=0, write_behind=10
+        ) as writer_shm_dict:
+            writer_shm_dict["buffered"] = 1
+            with pytest.raises(RuntimeError):
+                with writer_shm_dict.exclusive_lock():
+                    writer_shm_dict[dict_key] = 2
+                    raise RuntimeError("half made")
+            assert "buffered" not in self.vol_shm_dict
+
+            # which exceptions that changed nothing publish as usual
+            with pytest.raises(KeyError):
+                writer_shm_dict["missing"]
+            assert self.vol_shm_dict["buffered"] == 1
+            assert writer_shm_dict[dict_key] == 1
+
+    def test_multi_lock(self, dict_key):
+        test_rand_string = rand_string(10)
+        self.create_vol_shm_dict()
+        index_dict = SHMDict("PyTestSHMDictIndex", lock_timeout=0)
+
+        # Each dict is locked, loaded and saved once however often it's passed
+        with SHMDict.multi_lock(self.vol_shm_dict, index_dict, self.vol_shm_dict):
+            self.vol_shm_dict[dict_key] = test_rand_string
+            index_dict[test_rand_string] = dict_key
+            assert self.vol_shm_dict.semaphore.value == 0
+            assert index_dict.semaphore.value == 0
+        assert self.vol_shm_dict.semaphore.value == 1
+        assert index_dict.semaphore.value == 1
+        with SHMDict("PyTestSHMDictIndex", lock_timeout=0) as peer_index_dict:
+            assert peer_index_dict[test_rand_string] == dict_key
+
+            with pytest.raises(ValueError, match=r".*more than one handle.*"):
+                with SHMDict.multi_lock(index_dict, peer_index_dict):
+                    pass
+
+        # A busy dict backs off and gives up without keeping the others locked
+        peer_index_dict = SHMDict("PyTestSHMDictIndex", lock_timeout=0)
+        with index_dict.exclusive_lock():
+            with pytest.raises(posix_ipc.BusyError):
+                with SHMDict.multi_lock(
+                    self.vol_shm_dict, peer_index_dict, timeout=0.1
+                ):
+                    pass
+            assert self.vol_shm_dict.semaphore.value == 1
+        peer_index_dict.close()
+
+        # Locks already held by this thread are nested into
+        with self.vol_shm_dict.exclusive_lock():
+            with SHMDict.multi_lock(self.vol_shm_dict, index_dict):
+                del index_dict[test_rand_string]
+            assert self.vol_shm_dict.semaphore.value == 0
+        assert len(index_dict) == 0
+        index_dict.close()
+
+    def test_dump_load(self, tmpdir, dict_key):
+        test_rand_string = rand_string(10)
+        test_long_string = "".join([rand_string(16)] * mmap.PAGESIZE)
+        self.vol_shm_dict = SHMDict(
+            "PyTestSHMDict", lock_timeout=0, compression="zlib", ordered=True
+        )
+        self.vol_shm_dict[dict_key] = test_rand_string
+        self.vol_shm_dict["long"] = test_long_string
+        expected = self.vol_shm_dict.copy()
+
+        stream = io.BytesIO()
+        assert self.vol_shm_dict.dump(stream) == 2
+
+        # Loading replaces what was there and keeps indexes up to date
+        stream.seek(0)
+        self.create_per_shm_dict(tmpdir)
+        self.per_shm_dict["old"] = test_rand_string
+        self.per_shm_dict.add_index("length", len)
+        loaded = SHMDict.load(
+            stream, self.dict_filename(tmpdir), persist=True, lock_timeout=0
+        )
+        assert loaded.copy() == expected
+        assert self.per_shm_dict.copy() == expected
+        assert loaded.keys_where("length", len(test_long_string)) == ["long"]
+        loaded.close()
+
+        # Dumping from inside a lock includes the unsaved changes
+        with self.vol_shm_dict.exclusive_lock():
+            del self.vol_shm_dict["long"]
+            stream = io.BytesIO()
+            assert self.vol_shm_dict.dump(stream) == 1
+
+        stream.seek(0)
+        with pytest.raises(ValueError, match=r".*Not a shm_dict stream.*"):
+            SHMDict.load(io.BytesIO(b"not a stream"), "PyTestSHMDictLoad")
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_from_iterable(self, tmpdir, workers):
+        test_long_string = "".join([rand_string(16)] * mmap.PAGESIZE)
+        entries = [("key{}".format(number), number) for number in range(1000)]
+        entries.append(("long", test_long_string))
+        entries.append(("key0", "replaced"))
+        expected = dict(entries)
+
+        # Publishes in one go over what was there, keeping indexes
+        self.create_per_shm_dict(tmpdir)
+        self.per_shm_dict["old"] = 1
+        self.per_shm_dict.add_index("type", type)
+        _, old_version = self.per_shm_dict.get_with_version("old")
+        bulk_dict = SHMDict.from_iterable(
+            self.dict_filename(tmpdir),
+            iter(entries),
+            workers=workers,
+            persist=True,
+            lock_timeout=0,
+            compression="zlib",
+        )
+        assert self.per_shm_dict.copy() == expected
+        assert bulk_dict.copy() == expected
+        assert sorted(self.per_shm_dict.keys_where("type", str)) == ["key0", "long"]
+        assert self.per_shm_dict.get_with_version("key0")[1] > old_version
+        bulk_dict.close()
+
+        # The persist file is written too
+        persisted = shm_dict.persist.load_persist_file(self.per_shm_dict.persist_file)
+        assert persisted["key1"] == 1
+
+        # As is an empty dictionary
+        with SHMDict.from_iterable("PyTestSHMDictBulk", [], workers=workers) as empty:
+            assert empty.copy() == {}
+
+    def test_versions(self, dict_key):
+        self.create_vol_shm_dict()
+        with pytest.raises(KeyError):
+            self.vol_shm_dict.get_with_version(dict_key)
+
+        # None only inserts keys that don't exist yet
+        version = self.vol_shm_dict.put_if_version(dict_key, 1, None)
+        assert version > 0
+        assert self.vol_shm_dict.put_if_version(dict_key, 2, None) is None
+        assert self.vol_shm_dict.get_with_version(dict_key) == (1, version)
+
+        # A write through any handle moves the version on
+        value, version = self.vol_shm_dict.get_with_version(dict_key)
+        with SHMDict("PyTestSHMDict", lock_timeout=0) as peer_shm_dict:
+            peer_shm_dict[dict_key] = value + 10
+        assert self.vol_shm_dict.put_if_version(dict_key, value + 1, version) is None
+        assert self.vol_shm_dict[dict_key] == 11
+
+        value, version = self.vol_shm_dict.get_with_version(dict_key)
+        new_version = self.vol_shm_dict.put_if_version(dict_key, value + 1, version)
+        assert new_version > version
+        assert self.vol_shm_dict.get_with_version(dict_key) == (12, new_version)
+
+        del self.vol_shm_dict[dict_key]
+        assert self.vol_shm_dict.put_if_version(dict_key, 1, new_version) is None
+
+    def test_write_behind(self, dict_key):
+        self.create_vol_shm_dict()
+        self.vol_shm_dict[dict_key] = 0
+
+        with SHMDict(
+            "PyTestSHMDict", lock_timeout=0, write_behind=3
+        ) as writer_shm_dict, mock.patch.object(
+            SHMDict,
+            "_SHMDict__save_dict",
+            autospec=True,
+            side_effect=SHMDict._SHMDict__save_dict,
+        ) as save_dict:
+            # Peers don't see buffered keys until the buffer fills
+            writer_shm_dict[dict_key] = 1
+            writer_shm_dict["other"] = 1
+            assert self.vol_shm_dict[dict_key] == 0
+            assert "other" not in self.vol_shm_dict
+            writer_shm_dict[dict_key] = 2
+            writer_shm_dict["third"] = 3
+            assert self.vol_shm_dict[dict_key] == 2
+            assert self.vol_shm_dict["third"] == 3
+            # in a single save
+            writer_saves = [
+                call
+                for call in save_dict.call_args_list
+                if call[0][0] is writer_shm_dict
+            ]
+            assert len(writer_saves) == 1
+            del writer_saves
+            save_dict.reset_mock()
+
+            # The writing handle always reads its own writes
+            writer_shm_dict[dict_key] = 4
+            assert self.vol_shm_dict[dict_key] == 2
+            assert writer_shm_dict[dict_key] == 4
+            assert self.vol_shm_dict[dict_key] == 4
+
+            # Closing flushes
+            writer_shm_dict[dict_key] = 5
+            save_dict.reset_mock()
+        assert self.vol_shm_dict[dict_key] == 5
+
+        # Or the timer does
+        with SHMDict(
+            "PyTestSHMDict", lock_timeout=0, flush_interval=0.05
+        ) as writer_shm_dict:
+            writer_shm_dict[dict_key] = 6
+            writer_shm_dict.flush()
+            assert self.vol_shm_dict[dict_key] == 6
+            writer_shm_dict[dict_key] = 7
+            assert self.vol_shm_dict[dict_key] == 6
+            for _ in range(100):
+                if self.vol_shm_dict[dict_key] == 7:
+                    break
+                time.sleep(0.01)
+            assert self.vol_shm_dict[dict_key] == 7
+
+        # Values that can't be pickled are turned down when set, a key the
+        # ordered index turns down is dropped on its own
+        with SHMDict(
+            "PyTestSHMDict", lock_timeout=0, write_behind=10, ordered=True
+        ) as writer_shm_dict:
+            with pytest.raises(TypeError):
+                writer_shm_dict["lock"] = threading.Lock()
+            writer_shm_dict["good"] = 1
+            writer_shm_dict[1] = 1
+            writer_shm_dict.flush()
+        assert self.vol_shm_dict.range() == [dict_key, "good", "other", "third"]
+        assert 1 not in self.vol_shm_dict
+
+        # Handles left open neither hold up exiting nor lose their buffer
+        script = (
+            "from shm_dict import SHMDict; "
+            "writer = SHMDict('PyTestSHMDict', flush_interval=10); "
+            "writer[{!r}] = 8"
+        ).format(dict_key)
+        started = time.time()
+        subprocess.check_call([sys.executable, "-c", script])
+        assert time.time() - started < 5
+        assert self.vol_shm_dict[dict_key] == 8
+
+        # Destroying discards the buffer
+        writer_shm_dict = SHMDict("PyTestSHMDict", lock_timeout=0, flush_interval=10)
+        writer_shm_dict[dict_key] = 9
+        writer_shm_dict.destroy()
+        assert self.vol_shm_dict[dict_key] == 8
+
+    def test_lock_free_readonly(self, dict_key):
+        test_rand_string = rand_string(10)
+        self.create_vol_shm_dict()
+        self.vol_shm_dict[dict_key] = test_rand_string
+
+        with SHMDict("PyTestSHMDict", lock_timeout=0, readonly=True) as ro_shm_dict:
+            # Read only handles don't wait for a writer holding the lock
+            with self.vol_shm_dict.exclusive_lock():
+                assert ro_shm_dict[dict_key] == test_rand_string
+                assert ro_shm_dict.get_with_version(dict_key)[0] == test_rand_string
+
+            # but do while a save is under way
+            generation_offset = SUBHEADER_OFFSET + 24
+            map_file = self.vol_shm_dict.map_file
+            generation = struct.unpack_from("<Q", map_file, generation_offset)[0]
+            assert generation % 2 == 0
+            struct.pack_into("<Q", map_file, generation_offset, generation + 1)
+            with self.vol_shm_dict.exclusive_lock():
+                with pytest.raises(posix_ipc.BusyError):
+                    ro_shm_dict[dict_key]
+            struct.pack_into("<Q", map_file, generation_offset, generation)
+            assert ro_shm_dict[dict_key] == test_rand_string
+
+    def test_readonly(self, dict_key):
+        test_rand_string = rand_string(10)
+        test_rand_string_long = rand_string(mmap.PAGESIZE * 4)
+
+        # Attaching read only to a dict that doesn't exist
+        # yet must fail instead of creating the segment.
+        with pytest.raises(posix_ipc.ExistentialError):
+            SHMDict("PyTestSHMDict", lock_timeout=0, readonly=True)
+
+        self.create_vol_shm_dict()
+        self.vol_shm_dict[dict_key] = test_rand_string
+
+        ro_shm_dict = SHMDict("PyTestSHMDict", lock_timeout=0, readonly=True)
+        assert ro_shm_dict[dict_key] == test_rand_string
+        assert ro_shm_dict.map_file.size() == self.vol_shm_dict.map_file.size()
+
+        # Writes are refused without touching the segment
+        with pytest.raises(TypeError, match=r".*read only.*"):
+            ro_shm_dict[dict_key] = rand_string(10)
+        with pytest.raises(TypeError, match=r".*read only.*"):
+            del ro_shm_dict[dict_key]
+        with pytest.raises(TypeError, match=r".*read only.*"):
+            ro_shm_dict.clear()
+
+        # Growing the segment from the writer is picked up by the reader
+        self.vol_shm_dict[dict_key] = test_rand_string_long
+        assert ro_shm_dict[dict_key] == test_rand_string_long
+
+        # Deleting the reader must leave the segment in place
+        del ro_shm_dict
+        posix_ipc.SharedMemory(self.vol_shm_dict.safe_shm_name).close_fd()
+        assert self.vol_shm_dict[dict_key] == test_rand_string_long
+
+    def test_memory_stats(self, dict_key):
+        test_long_string = rand_string(mmap.PAGESIZE)
+        self.create_vol_shm_dict()
+        self.vol_shm_dict[dict_key] = rand_string(10)
+        self.vol_shm_dict["long"] = test_long_string
+
+        stats = self.vol_shm_dict.memory_stats(top=1)
+        assert stats.entries == 2
+        assert stats.largest_keys == [
+            ("long", len(pickle.dumps(("long", test_long_string), 2)))
+        ]
+        assert stats.payload_bytes == len(pickle.dumps(self.vol_shm_dict.copy(), 2))
+        assert stats.used == self.vol_shm_dict.usage().used
+        assert stats.slack == stats.segment_size - stats.used
+        assert stats.garbage == 0
+        assert 0 < stats.fragmentation < 1
+
+    def test_list_ipc_objects(self, dict_key):
+        self.create_vol_shm_dict()
+        self.vol_shm_dict[dict_key] = rand_string(10)
+        shm_name = self.vol_shm_dict.safe_shm_name
+        sem_name = self.vol_shm_dict.safe_sem_name
+
+        def own_objects(ipc_objects):
+            """Objects of this test, others on the host are left out."""
+            return (
+                [info for info in ipc_objects.segments if info.name == shm_name],
+                [info for info in ipc_objects.semaphores if info.name == sem_name],
+            )
+
+        segments, semaphores = own_objects(
+            shm_dict.segment.list_ipc_objects(names=["PyTestSHMDict"])
+        )
+        assert [info.label for info in segments] == ["PyTestSHMDict"]
+        assert [info.kind for info in segments] == ["SHMDict"]
+        assert [info.size for info in segments] == [self.vol_shm_dict.usage().capacity]
+        assert [info.attach_count for info in segments] == [1]
+        assert [info.label for info in semaphores] == ["PyTestSHMDict"]
+        assert [info.value for info in semaphores] == [1]
+
+        # Objects a handle left behind show up without asking for them
+        self.vol_shm_dict._close_handles()
+        try:
+            segments, semaphores = own_objects(shm_dict.segment.list_ipc_objects())
+            assert [info.label for info in segments] == [None]
+            assert [info.attach_count for info in segments] == [1]
+            assert [info.label for info in semaphores] == [None]
+        finally:
+            SHMDict("PyTestSHMDict").destroy()
+            self.vol_shm_dict = None
+        assert own_objects(shm_dict.segment.list_ipc_objects()) == ([], [])
+
+    def test_lifecycle(self, dict_key):
+        test_rand_string = rand_string(10)
+        self.create_vol_shm_dict()
+        # Asking for the attach count attaches an unused handle
+        assert self.vol_shm_dict.attach_count == 1
+        self.vol_shm_dict[dict_key] = test_rand_string
+        assert self.vol_shm_dict.owner is True
+        assert self.vol_shm_dict.attach_count == 1
+
+        # A short lived peer closing must not destroy the dict
+        with SHMDict("PyTestSHMDict", lock_timeout=0) as peer_shm_dict:
+            assert peer_shm_dict[dict_key] == test_rand_string
+            assert peer_shm_dict.owner is False
+            assert self.vol_shm_dict.attach_count == 2
+        assert self.vol_shm_dict.attach_count == 1
+        assert self.vol_shm_dict[dict_key] == test_rand_string
+
+        # Closing is idempotent and the handle is unusable afterwards
+        peer_shm_dict.close()
+        with pytest.raises(ValueError, match=r".*closed.*"):
+            peer_shm_dict[dict_key]
+
+        # The last handle to close unlinks the segment and semaphore
+        shm_name = self.vol_shm_dict.safe_shm_name
+        sem_name = self.vol_shm_dict.safe_sem_name
+        self.vol_shm_dict.close()
+        with pytest.raises(posix_ipc.ExistentialError):
+            posix_ipc.SharedMemory(shm_name)
+        with pytest.raises(posix_ipc.ExistentialError):
+            posix_ipc.Semaphore(sem_name)
+        self.vol_shm_dict = None
+
+    def test_reopen_unlinked_semaphore(self, dict_key):
+        self.create_vol_shm_dict()
+        self.vol_shm_dict[dict_key] = rand_string(10)
+
+        # A handle that opened the semaphore before the last handle
+        # closed, unlinking it, must not create the next segment under
+        # that orphaned semaphore
+        late_shm_dict = SHMDict("PyTestSHMDict", lock_timeout=0)
+        late_shm_dict.semaphore
+        self.vol_shm_dict.close()
+        self.vol_shm_dict = late_shm_dict
+        with SHMDict("PyTestSHMDict", lock_timeout=0) as peer_shm_dict:
+            with late_shm_dict.exclusive_lock():
+                late_shm_dict[dict_key] = rand_string(10)
+                with pytest.raises(posix_ipc.BusyError):
+                    peer_shm_dict[dict_key]
+
+    def test_forked_child(self, dict_key):
+        test_rand_string = rand_string(10)
+        self.create_vol_shm_dict()
+        self.vol_shm_dict[dict_key] = test_rand_string
+
+        # A child closing the handle it inherited must leave the
+        # parent's attach count, and the segment, alone
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.vol_shm_dict["child"] = test_rand_string
+                self.vol_shm_dict.close()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert self.vol_shm_dict.attach_count == 1
+        with SHMDict("PyTestSHMDict", lock_timeout=0) as peer_shm_dict:
+            assert peer_shm_dict[dict_key] == test_rand_string
+            assert peer_shm_dict["child"] == test_rand_string
+
+    def test_destroy(self, dict_key):
+        self.create_vol_shm_dict()
+        self.vol_shm_dict[dict_key] = rand_string(10)
+
+        peer_shm_dict = SHMDict("PyTestSHMDict", lock_timeout=0)
+        assert dict_key in peer_shm_dict
+
+        # Destroy unlinks regardless of other attached handles
+        peer_shm_dict.destroy()
+        with pytest.raises(posix_ipc.ExistentialError):
+            posix_ipc.SharedMemory(self.vol_shm_dict.safe_shm_name)
+        self.vol_shm_dict.close()
+        self.vol_shm_dict = None
+
+        # A new handle starts from a fresh, empty dictionary
+        self.create_vol_shm_dict()
+        assert len(self.vol_shm_dict) == 0
+        assert self.vol_shm_dict.owner is True
+
+    def test_persistent_warm_up(self, tmpdir, dict_key):
+        test_rand_string = rand_string(10)
+        self.create_per_shm_dict(tmpdir)
+        self.per_shm_dict[dict_key] = test_rand_string
+        self.per_shm_dict.close()
+
+        # Reopening with an empty segment reads the file lazily
+        # and publishes it into the segment in the background.
+        self.create_per_shm_dict(tmpdir, warm_up=True)
+        assert self.per_shm_dict[dict_key] == test_rand_string
+        self.per_shm_dict._warm_up_thread.join()
+
+        # A handle that never looks at the persist file sees the
+        # published contents straight from shared memory.
+        with SHMDict(self.dict_filename(tmpdir), lock_timeout=0) as shm_only:
+            assert shm_only[dict_key] == test_rand_string
+        self.per_shm_dict.destroy()
+
+        # The file is read without holding the semaphore, and isn't
+        # published over what a peer published meanwhile
+        load_persist_file = shm_dict.shm_dict.load_persist_file
+        warm_up_loads = []
+
+        def _load_and_publish(path):
+            loaded = load_persist_file(path)
+            warm_up_thread = self.per_shm_dict._warm_up_thread
+            if threading.current_thread() is warm_up_thread and not warm_up_loads:
+                warm_up_loads.append(path)
+                with SHMDict(path, persist=True, lock_timeout=1) as peer_shm_dict:
+                    peer_shm_dict["published"] = test_rand_string
+            return loaded
+
+        with mock.patch.object(
+            shm_dict.shm_dict, "load_persist_file", side_effect=_load_and_publish
+        ):
+            self.create_per_shm_dict(tmpdir, warm_up=True)
+            assert self.per_shm_dict[dict_key] == test_rand_string
+            self.per_shm_dict._warm_up_thread.join()
+        with SHMDict(self.dict_filename(tmpdir), lock_timeout=0) as shm_only:
+            assert shm_only[dict_key] == test_rand_string
+            assert shm_only["published"] == test_rand_string
+
+    def test_compression(self, dict_key):
+        test_rand_string = rand_string(10)
+        test_long_string = "".join([rand_string(16)] * mmap.PAGESIZE)
+        self.vol_shm_dict = SHMDict(
+            "PyTestSHMDict", lock_timeout=0, compression="zlib", compress_threshold=64
+        )
+
+        # Small values are stored as is, large ones compressed
+        # well below their raw size, both read back unchanged.
+        self.vol_shm_dict[dict_key] = test_rand_string
+        self.vol_shm_dict["long"] = test_long_string
+        assert self.vol_shm_dict[dict_key] == test_rand_string
+        assert self.vol_shm_dict["long"] == test_long_string
+        assert self.vol_shm_dict.map_file.size() < len(test_long_string) // 4
+        assert self.vol_shm_dict.copy() == {
+            dict_key: test_rand_string,
+            "long": test_long_string,
+        }
+
+        # Handles without compression configured still read them
+        with SHMDict("PyTestSHMDict", lock_timeout=0) as plain_shm_dict:
+            assert plain_shm_dict["long"] == test_long_string
+
+        with pytest.raises(ValueError, match=r".*not available.*"):
+            SHMDict("PyTestSHMDict", compression="snappy")
+
+    def test_ordered_index(self, tmpdir):
+        self.vol_shm_dict = SHMDict("PyTestSHMDict", lock_timeout=0, ordered=True)
+        for hour in range(24):
+            for minute in (0, 30):
+                key = "2019-08-28T{:02d}:{:02d}".format(hour, minute)
+                self.vol_shm_dict[key] = hour
+        self.vol_shm_dict["2019-08-29T00:00"] = 24
+
+        assert self.vol_shm_dict.keys_with_prefix("2019-08-28T1") == [
+            "2019-08-28T{:02d}:{:02d}".format(hour, minute)
+            for hour in range(10, 20)
+            for minute in (0, 30)
+        ]
+        assert self.vol_shm_dict.range("2019-08-28T22:00", "2019-08-29") == [
+            "2019-08-28T22:00",
+            "2019-08-28T22:30",
+            "2019-08-28T23:00",
+            "2019-08-28T23:30",
+        ]
+        assert self.vol_shm_dict.items_range("2019-08-28T23:30") == [
+            ("2019-08-28T23:30", 23),
+            ("2019-08-29T00:00", 24),
+        ]
+
+        # Handles that didn't ask for the index still maintain it
+        with SHMDict("PyTestSHMDict", lock_timeout=0) as peer_shm_dict:
+            del peer_shm_dict["2019-08-28T23:00"]
+            peer_shm_dict["2019-08-28T23:15"] = 23
+        assert self.vol_shm_dict.range("2019-08-28T23", "2019-08-29") == [
+            "2019-08-28T23:15",
+            "2019-08-28T23:30",
+        ]
+
+        # A key that can't be ordered leaves the dictionary unchanged
+        with pytest.raises(TypeError):
+            self.vol_shm_dict[1] = 1
+        assert 1 not in self.vol_shm_dict
+
+        self.vol_shm_dict.clear()
+        assert self.vol_shm_dict.range() == []
+
+        # Reading a lazily opened persist file doesn't build the index,
+        # which would load and rewrite the whole file, the first write does
+        self.create_per_shm_dict(tmpdir)
+        self.per_shm_dict.update(b=2, a=1)
+        self.per_shm_dict.close()
+        with open(self.dict_filename(tmpdir), "rb") as persist_file:
+            persisted = persist_file.read()
+        self.per_shm_dict = SHMDict(
+            self.dict_filename(tmpdir),
+            persist=True,
+            lock_timeout=0,
+            warm_up=False,
+            ordered=True,
+        )
+        assert self.per_shm_dict["a"] == 1
+        assert self.per_shm_dict.range() == ["a", "b"]
+        with open(self.dict_filename(tmpdir), "rb") as persist_file:
+            assert persist_file.read() == persisted
+        self.per_shm_dict["c"] = 3
+        assert self.per_shm_dict.keys_with_prefix("c") == ["c"]
+
+    def test_secondary_index(self):
+        self.create_vol_shm_dict()
+        self.vol_shm_dict["alice"] = {"team": "red", "score": 3}
+        self.vol_shm_dict["bob"] = {"team": "blue", "score": 5}
+        self.vol_shm_dict.add_index("team", operator.itemgetter("team"))
+        self.vol_shm_dict["carol"] = {"team": "red", "score": 7}
+
+        assert sorted(self.vol_shm_dict.keys_where("team", "red")) == [
+            "alice",
+            "carol",
+        ]
+        assert self.vol_shm_dict.items_where("team", "blue") == [
+            ("bob", {"team": "blue", "score": 5})
+        ]
+
+        # Updates move entries between index values
+        with SHMDict("PyTestSHMDict", lock_timeout=0) as peer_shm_dict:
+            peer_shm_dict["alice"] = {"team": "blue", "score": 3}
+            del peer_shm_dict["bob"]
+        assert self.vol_shm_dict.keys_where("team", "red") == ["carol"]
+        assert self.vol_shm_dict.keys_where("team", "blue") == ["alice"]
+        assert self.vol_shm_dict.keys_where("team", "green") == []
+
+        # Range queries still work, sorting on the spot, without an ordered index
+        assert self.vol_shm_dict.range("b") == ["carol"]
+
+        # Neither the dictionary nor the index take a value key_func fails on
+        with pytest.raises(TypeError):
+            self.vol_shm_dict["dave"] = None
+        assert "dave" not in self.vol_shm_dict
+
+        # A key_func that can't be pickled is turned down straight away
+        with pytest.raises((pickle.PicklingError, AttributeError)):
+            self.vol_shm_dict.add_index("score", lambda value: value["score"])
+        self.vol_shm_dict["erin"] = {"team": "green", "score": 1}
+        assert self.vol_shm_dict.keys_where("team", "green") == ["erin"]
+
+        self.vol_shm_dict.drop_index("team")
+        with pytest.raises(KeyError):
+            self.vol_shm_dict.keys_where("team", "red")
+
+    def test_index_module_missing(self, monkeypatch, tmpdir):
+        tmpdir.join("pytest_shm_dict_keys.py").write(
+            "def team(value):\n    return value['team']\n"
+        )
+        with monkeypatch.context() as monkey:
+            monkey.syspath_prepend(str(tmpdir))
+            import pytest_shm_dict_keys
+
+            self.create_vol_shm_dict()
+            self.vol_shm_dict["alice"] = {"team": "red"}
+            self.vol_shm_dict.add_index("team", pytest_shm_dict_keys.team)
+        monkeypatch.delitem(sys.modules, "pytest_shm_dict_keys")
+
+        # Processes that can't import key_func's module only need it to
+        # maintain or query the index
+        with SHMDict("PyTestSHMDict", readonly=True) as reader_shm_dict:
+            assert reader_shm_dict["alice"] == {"team": "red"}
+            assert reader_shm_dict.copy() == {"alice": {"team": "red"}}
+            with pytest.raises(ImportError):
+                reader_shm_dict.keys_where("team", "red")
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+import multiprocessing
+import threading
+
+# Related third party imports (If you used pip/apt/yum to install)
+import posix_ipc
+import pytest
+import six
+
+# Local application/library specific imports (Look ma! I wrote it myself!)
+from shm_dict import SHMDict, SHMQueue
+
+__author__ = "Nate Bohman"
+__credits__ = ["Nate Bohman"]
+__license__ = "LGPL-3"
+__maintainer__ = "Nate Bohman"
+__email__ = "natrinicle@natrinicle.com"
+__status__ = "Production"
+
+
+def produce(name, start, count):
+    """Put count consecutive integers from start on a queue."""
+    with SHMQueue(name) as queue:
+        for number in range(start, start + count):
+            queue.put(number, timeout=10)
+
+
+class TestSHMQueue(object):
+
+    queue = None
+
+    def create_queue(self, **kwargs):
+        """Create a shared memory queue for testing."""
+        self.queue = SHMQueue("PyTestSHMQueue", lock_timeout=1, **kwargs)
+        return self.queue
+
+    def teardown_method(self, method):
+        if self.queue is not None:
+            self.queue.close()
+            self.queue = None
+
+    def test_put_get(self):
+        self.create_queue(capacity=4, slot_size=64)
+        assert self.queue.capacity == 4
+        assert self.queue.slot_size == 64
+        assert self.queue.empty() is True
+
+        self.queue.put(b"raw")
+        self.queue.put({"pickled": [1, 2]})
+        assert self.queue.qsize() == 2
+        assert self.queue.get() == b"raw"
+        assert self.queue.get() == {"pickled": [1, 2]}
+        assert self.queue.empty() is True
+
+        with pytest.raises(posix_ipc.BusyError):
+            self.queue.get(timeout=0)
+        with pytest.raises(ValueError, match=r".*doesn't fit 64 byte slots.*"):
+            self.queue.put(b"x" * 65)
+
+    def test_bounded(self):
+        self.create_queue(capacity=2, slot_size=16)
+        self.queue.put_many([1, 2])
+        assert self.queue.full() is True
+        with pytest.raises(posix_ipc.BusyError):
+            self.queue.put(3, timeout=0)
+
+        # A batch that doesn't fit queues nothing
+        assert self.queue.get() == 1
+        with pytest.raises(posix_ipc.BusyError):
+            self.queue.put_many([3, 4], timeout=0)
+        assert self.queue.qsize() == 1
+
+        # Wrap around the end of the ring
+        self.queue.put(3)
+        assert self.queue.get_many(10) == [2, 3]
+
+        # A batch larger than the queue could never be put
+        with pytest.raises(ValueError, match=r".*can never fit the 2 slots.*"):
+            self.queue.put_many([1, 2, 3])
+
+    def test_bytes_like(self):
+        self.create_queue(capacity=3, slot_size=16)
+        self.queue.put_many([b"bytes", bytearray(b"bytearray"), memoryview(b"view")])
+        assert self.queue.get_many(3) == [b"bytes", b"bytearray", b"view"]
+
+    @pytest.mark.skipif(six.PY2, reason="Python 2 mmaps can't be viewed")
+    def test_zero_copy(self):
+        self.create_queue(capacity=3, slot_size=16)
+        self.queue.put_many([b"first", b"second"])
+        view = self.queue.get(copy=False)
+        assert isinstance(view, memoryview)
+        # Only Python 3.8 onwards can make the view read only
+        assert view.readonly is hasattr(view, "toreadonly")
+        assert view == b"first"
+
+        # The viewed slot, and every slot after it, isn't reused until
+        # the view is released by the next get
+        self.queue.put(b"third", timeout=0)
+        with pytest.raises(posix_ipc.BusyError):
+            self.queue.put(b"fourth", timeout=0)
+
+        assert self.queue.get() == b"second"
+        with pytest.raises(ValueError):
+            view.tobytes()
+        self.queue.put(b"fourth", timeout=0)
+        assert self.queue.get_many(2) == [b"third", b"fourth"]
+
+        # Views still held don't stop the queue being destroyed
+        self.queue.put(b"fifth", timeout=0)
+        view = self.queue.get(copy=False)
+        self.queue.destroy()
+        self.queue = None
+        with pytest.raises(ValueError):
+            view.tobytes()
+
+    @pytest.mark.skipif(not six.PY2, reason="Python 3 returns a view")
+    def test_zero_copy_python2(self):
+        self.create_queue(capacity=2, slot_size=16)
+        self.queue.put(b"first")
+        assert self.queue.get(copy=False) == b"first"
+        assert self.queue.empty() is True
+
+    def test_threads(self):
+        self.create_queue(capacity=4, slot_size=16)
+        consumed = []
+
+        def consume():
+            with SHMQueue("PyTestSHMQueue") as queue:
+                for _ in range(50):
+                    consumed.append(queue.get(timeout=10))
+
+        consumers = [threading.Thread(target=consume) for _ in range(2)]
+        for consumer in consumers:
+            consumer.start()
+        for number in range(100):
+            self.queue.put(number, timeout=10)
+        for consumer in consumers:
+            consumer.join()
+        assert sorted(consumed) == list(range(100))
+
+    def test_batch_threads(self):
+        self.create_queue(capacity=4, slot_size=16)
+        received = []
+
+        # Batches that each need most of the slots must not end up
+        # holding part of them each while waiting for the rest
+        def produce_batches(start):
+            with SHMQueue("PyTestSHMQueue") as queue:
+                for number in range(start, start + 150, 3):
+                    queue.put_many([number, number + 1, number + 2], timeout=10)
+
+        producers = [
+            threading.Thread(target=produce_batches, args=(start,))
+            for start in (0, 150)
+        ]
+        for producer in producers:
+            producer.start()
+        while len(received) < 300:
+            received.extend(self.queue.get_many(4, timeout=10))
+        for producer in producers:
+            producer.join()
+        assert sorted(received) == list(range(300))
+
+    def test_processes(self):
+        self.create_queue(capacity=8, slot_size=16)
+        producers = [
+            multiprocessing.Process(
+                target=produce, args=("PyTestSHMQueue", start * 100, 100)
+            )
+            for start in range(3)
+        ]
+        for producer in producers:
+            producer.start()
+
+        received = []
+        while len(received) < 300:
+            received.extend(self.queue.get_many(16, timeout=10))
+        for producer in producers:
+            producer.join()
+        assert sorted(received) == list(range(300))
+
+    def test_foreign_segment(self):
+        with SHMDict("PyTestSHMQueue") as shm_dict:
+            shm_dict["key"] = "value"
+            with pytest.raises(ValueError, match=r".*not created by a SHMQueue.*"):
+                SHMQueue("PyTestSHMQueue")